@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Benchmarks of the Obelix-Client ranking and logging hot paths.
+
+Run from the repository root::
+
+    python benchmarks/bench_obelix.py --output before.json
+    python benchmarks/bench_obelix.py --output after.json --compare before.json
+
+Every result is the best time per call over ``--repeat`` runs, in seconds.
+The JSON output holds the environment and the results, ``--compare``
+prints the ratio to a previous output for the benchmarks both contain.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from obelix_client import encoders as obelix_encoders  # noqa: E402
+from obelix_client import utils  # noqa: E402
+from obelix_client.api import CONFIG, Obelix  # noqa: E402
+from obelix_client.hitset import SortedHitset  # noqa: E402
+from obelix_client.queue import RedisQueue  # noqa: E402
+from obelix_client.storage import RedisMock, RedisStorage  # noqa: E402
+
+HITSET_SIZES = (10, 1000, 100000, 1000000)
+
+RECOMMENDATION_SIZES = (0, 100, 10000, 100000)
+
+QUICK_HITSET_SIZES = (10, 1000, 10000)
+
+QUICK_RECOMMENDATION_SIZES = (0, 100, 1000)
+
+
+def encoders():
+    """Encoders available for the benchmarks."""
+    available = {'json': json}
+    fast_json = obelix_encoders.JsonEncoder()
+    if fast_json.backend is not json:
+        available['json-fast'] = fast_json
+    if obelix_encoders.msgpack is not None:
+        available['msgpack'] = obelix_encoders.MsgpackEncoder()
+    return available
+
+
+def make_hitset(size, rnd):
+    """Sorted hitset, latest last, with gaps like real recids."""
+    return sorted(rnd.sample(range(1, size * 3 + 1), size))
+
+
+def make_recommendations(size, hitset, rnd):
+    """Recommendations, half of them in the hitset."""
+    in_hitset = rnd.sample(hitset, min(size // 2, len(hitset)))
+    others = range(len(hitset) * 3 + 1, len(hitset) * 3 + 1 + size)
+    recids = in_hitset + list(others)[:size - len(in_hitset)]
+    return dict((recid, rnd.random()) for recid in recids)
+
+
+def measure(func, repeat):
+    """Best time per call of func, in seconds."""
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= 0.2 or number >= 1000000:
+            break
+        number *= 10
+    return min([elapsed] + timer.repeat(repeat - 1, number)) / number
+
+
+def bench_scoring(sizes, reco_sizes, repeat, rnd):
+    """Order scoring, recommendation blending and sorting."""
+    config = CONFIG.copy()
+    for size in sizes:
+        hitset = make_hitset(size, rnd)
+        hitset.reverse()
+        by_order = utils.rank_records_by_order(config, hitset)
+
+        yield ('rank_records_by_order', {'hitset': size},
+               measure(lambda: utils.rank_records_by_order(config, hitset),
+                       repeat))
+        yield ('sort_records_by_score', {'hitset': size},
+               measure(lambda: utils.sort_records_by_score(by_order), repeat))
+        yield ('top_records_by_score', {'hitset': size, 'limit': 10},
+               measure(lambda: utils.top_records_by_score(by_order, 10),
+                       repeat))
+
+        for reco_size in reco_sizes:
+            recommendations = make_recommendations(reco_size, hitset, rnd)
+            yield ('calc_scores', {'hitset': size, 'recommendations':
+                                   reco_size},
+                   measure(lambda: utils.calc_scores(config, by_order,
+                                                     recommendations),
+                           repeat))
+
+
+def bench_rank_records(sizes, reco_sizes, repeat, rnd):
+    """
+    End to end ranking, recommendations from a RedisMock storage.
+
+    Hitsets are given as lists, and as sorted arrays like Invenio's. The
+    encoder varies for the cache and the queues only: recommendations
+    are stored with msgpack, or not encoded without it, as JSON would
+    turn their recids to strings that match no record.
+    """
+    available = encoders()
+    reco_encoder = available.get('msgpack')
+    for name, encoder in sorted(available.items()):
+        for size in sizes:
+            hitset = make_hitset(size, rnd)
+            sorted_hitset = obelix_encoders.int64_array(hitset)
+            prebuilt_hitset = SortedHitset(sorted_hitset)
+            for reco_size in reco_sizes:
+                recommendations = RedisStorage(RedisMock(), 'reco::',
+                                               encoder=reco_encoder)
+                recommendations.set(1, make_recommendations(reco_size,
+                                                            hitset, rnd))
+                obelix = Obelix(RedisStorage(RedisMock(), encoder=encoder),
+                                recommendations,
+                                RedisQueue(RedisMock(), encoder=encoder),
+                                {'ranked_cache_size': 0,
+                                 'recommendations_snapshot_size': 0})
+                yield ('rank_records', {'hitset': size,
+                                        'recommendations': reco_size,
+                                        'encoder': name},
+                       measure(lambda: obelix.rank_records(hitset, 1),
+                               repeat))
+                yield ('rank_records_sorted_array',
+                       {'hitset': size, 'recommendations': reco_size,
+                        'encoder': name},
+                       measure(lambda: obelix.rank_records(sorted_hitset, 1),
+                               repeat))
+                yield ('rank_records_sorted_hitset',
+                       {'hitset': size, 'recommendations': reco_size,
+                        'encoder': name},
+                       measure(lambda: obelix.rank_records(prebuilt_hitset,
+                                                           1),
+                               repeat))
+
+
+def bench_logging(sizes, repeat, rnd):
+    """Search result and page view logging."""
+    user_info = {'uid': 1, 'remote_ip': "127.0.0.1", "uri": "/record/1"}
+    for name, encoder in sorted(encoders().items()):
+        for size in sizes:
+            record_ids = [make_hitset(size, rnd), make_hitset(size, rnd)]
+            scores = [[0.5] * size, [0.5] * size]
+            queue_storage = RedisMock()
+            obelix = Obelix(RedisStorage(RedisMock(), encoder=encoder),
+                            RedisStorage(RedisMock(), 'reco::'),
+                            RedisQueue(queue_storage, encoder=encoder))
+            recid = record_ids[1][-1]
+
+            def log_search_result():
+                obelix.log_search_result(user_info, record_ids, record_ids,
+                                         scores, ["A", "B"], 0.1, 0, 10,
+                                         "r", "c")
+                queue_storage.delete("statistics-search-result")
+
+            def log_page_view():
+                obelix.log_page_view_for_analytics(1, recid, "127.0.0.1",
+                                                   "/record/1",
+                                                   "events.pageviews",
+                                                   user_info)
+                queue_storage.delete("statistics-page-view")
+
+            yield ('log_search_result', {'hits': size, 'encoder': name},
+                   measure(log_search_result, repeat))
+            yield ('log_page_view_for_analytics', {'hits': size,
+                                                   'encoder': name},
+                   measure(log_page_view, repeat))
+
+            # Page views only read the index of the shown page
+            obelix = Obelix(RedisStorage(RedisMock(), encoder=encoder),
+                            RedisStorage(RedisMock(), 'reco::'),
+                            RedisQueue(queue_storage, encoder=encoder),
+                            {'last_search_index': True})
+            recid = record_ids[1][9]
+            yield ('log_search_result_indexed', {'hits': size,
+                                                 'encoder': name},
+                   measure(log_search_result, repeat))
+            yield ('log_page_view_indexed', {'hits': size, 'encoder': name},
+                   measure(log_page_view, repeat))
+
+
+def bench_encoders(sizes, repeat, rnd):
+    """Per event encoding and decoding cost."""
+    user_info = {'uid': 1, 'remote_ip': "127.0.0.1", "uri": "/record/1",
+                 'agent': "Mozilla/5.0", 'referer': "/search?p=ellis"}
+    page_view = {'search_timestamp': time.time(), 'recid': 1,
+                 'timestamp': time.time(), 'uid': 1,
+                 'remote_ip': "127.0.0.1", 'uri': "/record/1", 'jrec': 0,
+                 'rg': 10, 'rm': "r", 'cc': "c", 'hit_number_local': 3,
+                 'hit_number_global': 3, 'recommendations': {},
+                 'recid_in_recommendations': False,
+                 'type': "events.pageviews", 'user_info': user_info}
+    all_encoders = encoders()
+    all_encoders['recid-list'] = obelix_encoders.RecidListEncoder()
+
+    for name, encoder in sorted(all_encoders.items()):
+        if name != 'recid-list':
+            data = encoder.dumps(page_view)
+            yield ('encode_page_view', {'encoder': name},
+                   measure(lambda: encoder.dumps(page_view), repeat))
+            yield ('decode_page_view', {'encoder': name},
+                   measure(lambda: encoder.loads(data), repeat))
+
+        for size in sizes:
+            recids = make_hitset(size, rnd)
+            data = encoder.dumps(recids)
+            yield ('encode_recids', {'encoder': name, 'hits': size},
+                   measure(lambda: encoder.dumps(recids), repeat))
+            yield ('decode_recids', {'encoder': name, 'hits': size},
+                   measure(lambda: encoder.loads(data), repeat))
+
+
+BENCHMARKS = {
+    'encoders': lambda args, rnd: bench_encoders(args.sizes, args.repeat,
+                                                 rnd),
+    'scoring': lambda args, rnd: bench_scoring(
+        args.sizes, args.recommendation_sizes, args.repeat, rnd),
+    'rank_records': lambda args, rnd: bench_rank_records(
+        args.sizes, args.recommendation_sizes, args.repeat, rnd),
+    'logging': lambda args, rnd: bench_logging(args.sizes, args.repeat, rnd),
+}
+
+
+def git_revision():
+    """Current git commit, if any."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    """Key identifying a benchmark across outputs."""
+    return result['name'], tuple(sorted(result['params'].items()))
+
+
+def compare(results, baseline):
+    """Print the time ratio to a baseline output."""
+    previous = dict((result_key(result), result['seconds'])
+                    for result in baseline['results'])
+    for result in results:
+        key = result_key(result)
+        if key in previous:
+            sys.stderr.write("{0:<30} {1:<60} {2:8.3f}x\n".format(
+                result['name'], json.dumps(result['params'], sort_keys=True),
+                result['seconds'] / previous[key]))
+
+
+def main(argv=None):
+    """Run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmarks', nargs='*',
+                        help="benchmarks to run among {0}, all by "
+                        "default".format(", ".join(sorted(BENCHMARKS))))
+    parser.add_argument('--sizes', type=int, nargs='+', default=HITSET_SIZES,
+                        help="hitset sizes")
+    parser.add_argument('--recommendation-sizes', type=int, nargs='+',
+                        default=RECOMMENDATION_SIZES,
+                        help="recommendation sizes")
+    parser.add_argument('--quick', action='store_true',
+                        help="small sizes, for a smoke run")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="JSON file, stdout by default")
+    parser.add_argument('--compare', help="previous JSON output")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: {0}".format(
+            ", ".join(sorted(unknown))))
+
+    if args.quick:
+        args.sizes = QUICK_HITSET_SIZES
+        args.recommendation_sizes = QUICK_RECOMMENDATION_SIZES
+
+    results = []
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        for bench, params, seconds in BENCHMARKS[name](
+                args, random.Random(args.seed)):
+            results.append({'name': bench, 'params': params,
+                            'seconds': seconds})
+            sys.stderr.write("{0:<30} {1:<60} {2:.6f}s\n".format(
+                bench, json.dumps(params, sort_keys=True), seconds))
+
+    output = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'revision': git_revision(),
+              'timestamp': time.time(),
+              'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(output, fp, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(results, json.load(fp))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Obelix-Client for asyncio.
+
+Awaitable counterparts of :class:`~obelix_client.api.Obelix`, the storage
+and the queue proxies. The backends are expected to offer the same
+get/set and lpush/rpush/lpop/rpop methods as their blocking versions, as
+coroutines (i.e. ``redis.asyncio.Redis``).
+
+Requires Python 3.5 or newer, hence it is not imported by the package.
+"""
+
+import asyncio
+import time
+
+from . import utils
+from .api import _MISSING, Obelix, _SnapshotEntry
+from .metrics import NullMetrics, clock
+from .queue import RedisQueue
+from .storage import RedisMock, StorageProxy
+
+
+class AsyncStorageProxy(StorageProxy):
+
+    """Generic Storage for asyncio backends."""
+
+    async def get(self, key, default=None):
+        """Get a key."""
+        key = self._key(key)
+
+        try:
+            data = await self.storage.get(key)
+        except KeyError:
+            data = None
+
+        return self._decode(data, default)
+
+    async def set(self, key, value, ttl=None):
+        """Set a key, value pair, expiring after ``ttl`` seconds."""
+        if ttl is None:
+            await self.storage.set(self._key(key), self._encode(value))
+        else:
+            await self.storage.set(self._key(key), self._encode(value),
+                                   ex=ttl)
+
+    async def get_many(self, keys, default=None):
+        """Get several keys with one MGET."""
+        datas = await self.storage.mget([self._key(key) for key in keys])
+        return [self._decode(data, default) for data in datas]
+
+    async def set_many(self, mapping):
+        """Set several key, value pairs with one MSET."""
+        await self.storage.mset(dict((self._key(key), self._encode(value))
+                                     for key, value in mapping.items()))
+
+
+class AsyncRedisStorage(AsyncStorageProxy):
+
+    """Wrapper for asyncio Redis."""
+
+
+class AsyncRedisQueue(RedisQueue):
+
+    """Redis Queue Proxy for asyncio backends, takes care of de/encoding."""
+
+    async def lpush(self, queue, *values):
+        """Left Push one or more values to queue and encode them."""
+        await self.storage.lpush(self._queue(queue),
+                                 *self._encode(values, queue))
+
+    async def rpush(self, queue, *values):
+        """Right Push one or more values to queue and encode them."""
+        await self.storage.rpush(self._queue(queue),
+                                 *self._encode(values, queue))
+
+    async def rpop(self, queue):
+        """Right Pop from queue and decode value."""
+        return self._decode(await self.storage.rpop(self._queue(queue)))
+
+    async def lpop(self, queue):
+        """Left Pop from queue and decode value."""
+        return self._decode(await self.storage.lpop(self._queue(queue)))
+
+    async def rpop_many(self, queue, count):
+        """Right Pop up to ``count`` values, see RedisQueue.rpop_many."""
+        datas = await self.storage.rpop(self._queue(queue), count)
+        return [self._decode(data) for data in datas or ()]
+
+    async def brpop_many(self, queue, count, timeout=0):
+        """Right Pop up to ``count`` values, see RedisQueue.brpop_many."""
+        queue = self._queue(queue)
+        first = await self.storage.brpop([queue], timeout)
+        if first is None:
+            return []
+
+        datas = [first[1]]
+        if count > 1:
+            datas.extend(await self.storage.rpop(queue, count - 1) or ())
+        return [self._decode(data) for data in datas]
+
+    def iter_drain(self, queue, batch_size=1000):
+        """
+        Iterate over the values of queue until it is empty.
+
+        To use with ``async for``, see RedisQueue.iter_drain.
+        """
+        return _AsyncDrain(self, queue, batch_size)
+
+
+class _AsyncDrain(object):
+
+    """Asynchronous iterator draining a queue, batch by batch."""
+
+    def __init__(self, queue, name, batch_size):
+        self.queue = queue
+        self.name = name
+        self.batch_size = batch_size
+        self.values = []
+        self.done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.values and not self.done:
+            values = await self.queue.rpop_many(self.name, self.batch_size)
+            self.done = len(values) < self.batch_size
+            self.values = values[::-1]
+        if not self.values:
+            raise StopAsyncIteration
+        return self.values.pop()
+
+
+class AsyncRedisMock(RedisMock):
+
+    """
+    Redis Mock for asyncio.
+
+    Implements asyncio Redis based on dictionary's
+    """
+
+    #: Seconds between two checks of the queues in brpop
+    poll_interval = 0.01
+
+    async def get(self, key, default=None):
+        """Get a key."""
+        return super(AsyncRedisMock, self).get(key, default)
+
+    async def set(self, key, value, ex=None):
+        """Set a key, value pair, expiring after ``ex`` seconds."""
+        super(AsyncRedisMock, self).set(key, value, ex)
+
+    async def mget(self, keys):
+        """Get several keys, None for the missing ones."""
+        return super(AsyncRedisMock, self).mget(keys)
+
+    async def mset(self, mapping):
+        """Set several key, value pairs."""
+        super(AsyncRedisMock, self).mset(mapping)
+
+    async def lpush(self, queue, *values):
+        """Left Push one or more values to queue."""
+        super(AsyncRedisMock, self).lpush(queue, *values)
+
+    async def rpush(self, queue, *values):
+        """Right Push one or more values to queue."""
+        super(AsyncRedisMock, self).rpush(queue, *values)
+
+    async def rpop(self, queue, count=None):
+        """Right Pop from queue (Item gets removed)."""
+        return super(AsyncRedisMock, self).rpop(queue, count)
+
+    async def lpop(self, queue, count=None):
+        """Left Pop from queue (Item gets removed)."""
+        return super(AsyncRedisMock, self).lpop(queue, count)
+
+    async def brpop(self, keys, timeout=0):
+        """
+        Right Pop from the first non empty queue.
+
+        Polls the queues up to ``timeout`` seconds (0 is forever), without
+        blocking the event loop.
+
+        :return: tuple (queue, item) or None on timeout
+        """
+        if not isinstance(keys, (list, tuple)):
+            keys = [keys]
+        deadline = time.time() + timeout if timeout else None
+
+        while True:
+            for queue in keys:
+                item = super(AsyncRedisMock, self).rpop(queue)
+                if item is not None:
+                    return queue, item
+
+            if deadline is not None and time.time() >= deadline:
+                return None
+            await asyncio.sleep(self.poll_interval)
+
+
+class AsyncSendToObelix(object):
+
+    """Save data to the Obelix queue, for asyncio queues."""
+
+    def __init__(self, queue, metrics=None):
+        self.queue = queue
+        self.metrics = metrics or NullMetrics()
+
+    async def push(self, queue, data):
+        """Push to a queue."""
+        start = clock()
+        await self.queue.lpush(queue, data)
+        if self.metrics.enabled:
+            self.metrics.timing('queue.{0}.push'.format(queue),
+                                clock() - start)
+            self.metrics.incr('queue.{0}.events'.format(queue))
+
+    async def flush(self):
+        """Nothing is buffered, for symmetry with SendToObelix."""
+
+    async def statistics_search_result(self, data):
+        """Push to statistics_search_result."""
+        await self.push("statistics-search-result", data)
+
+    async def statistics_page_view(self, data):
+        """Push to statistics_page_view."""
+        await self.push("statistics-page-view", data)
+
+    async def save_to_neo_feeder(self, data):
+        """Push to logentries."""
+        await self.push("logentries", data)
+
+
+class AsyncObelix(Obelix):
+
+    """
+    Obelix-Client for asyncio.
+
+    The storages have to be asyncio ones, i.e. :class:`AsyncRedisStorage`
+    and :class:`AsyncRedisQueue`. Call :meth:`save_settings` once after
+    creating the client, as the blocking client does on init.
+    """
+
+    def __init__(self, cache_storage, recommendation_storage, queue_storage,
+                 config=None,
+                 logger=None, metrics=None):
+        """Initialize the Obelix-Client connector."""
+        self._configure(cache_storage, recommendation_storage, queue_storage,
+                        config, logger, metrics)
+
+    def _make_publisher(self, queue_storage):
+        """Create the publisher pushing the events to the queues."""
+        return AsyncSendToObelix(queue_storage, self.metrics)
+
+    async def save_settings(self):
+        """Store the settings in the cache."""
+        await self.cache.set("settings", self.config)
+        if self.config['compact_events']:
+            await self.cache.set(self._settings_key(), self.config)
+
+    async def get_recommendations(self, user_id):
+        """
+        Get the recommendations of a user, None if there are none.
+
+        See :meth:`Obelix.get_recommendations`.
+        """
+        entry = self.recommendations_snapshot.get(user_id, _MISSING)
+        if entry is _MISSING:
+            self.metrics.incr('cache.recommendations.miss')
+            entry = _SnapshotEntry(await self.recommendations.get(user_id))
+            self.recommendations_snapshot.set(user_id, entry)
+        else:
+            self.metrics.incr('cache.recommendations.hit')
+        return entry.recommendations
+
+    async def get_recommendations_many(self, user_ids):
+        """
+        Get the recommendations of several users in one round trip.
+
+        See :meth:`Obelix.get_recommendations_many`.
+        """
+        found, missing = self._snapshot_recommendations(user_ids)
+        if missing:
+            fetched = await self.recommendations.get_many(missing)
+            self._update_snapshot(found, missing, fetched)
+        return found
+
+    async def rank_records_batch(self, requests, processes=None):
+        """
+        Rank many search results at once.
+
+        See :meth:`Obelix.rank_records_batch`, the ranking itself blocks.
+        """
+        requests = [self._batch_request(*request) for request in requests]
+        recommendations = await self.get_recommendations_many(
+            [user_id for _, user_id, _, _ in requests])
+        return self._rank_batch(requests, recommendations, processes)
+
+    async def rank_records(self, hitset, user_id, rg=10, jrec=0,
+                           recommendations=None):
+        """
+        Rank a given search result based on recommendations.
+
+        See :meth:`Obelix.rank_records`.
+        """
+        start = clock()
+        if recommendations is None:
+            with self.metrics.timer('rank.fetch'):
+                recommendations = await self.get_recommendations(user_id)
+        with self.metrics.timer('rank.reverse'):
+            hitset = utils.as_hitset(hitset)
+
+        page = self._rank_page(hitset, user_id, recommendations, rg, jrec)
+        self._rank_done(start)
+        return page
+
+    async def flush(self):
+        """Push the events buffered by the queue publisher."""
+        await self.send_to_obelix.flush()
+
+    async def log_search_result(self, user_info, original_result_ordered,
+                                record_ids, results_final_colls_scores,
+                                cols_in_result_ordered,
+                                seconds_to_rank_and_print, jrec, rg, rm, cc,
+                                recommendations=None):
+        """Log a search result, see :meth:`Obelix.log_search_result`."""
+        uid = user_info.get(self.config['user_identifier'])
+        if recommendations is None:
+            recommendations = await self.get_recommendations(uid)
+        last_searches, data = self._search_result_data(
+            user_info, original_result_ordered, record_ids,
+            results_final_colls_scores, cols_in_result_ordered,
+            seconds_to_rank_and_print, jrec, rg, rm, cc, recommendations)
+
+        await asyncio.gather(
+            self.send_to_obelix.statistics_search_result(data),
+            *[self._set_last_search(storage_key, last_search)
+              for storage_key, last_search in last_searches.items()])
+
+    async def log_page_view_after_search(self, user_info, recid,
+                                         recommendations=None):
+        """Log a page view."""
+        await self.log_page_view(user_info, recid,
+                                 req_type="events.pageviews",
+                                 file_format="page_view",
+                                 recommendations=recommendations)
+
+    async def log_download_after_search(self, user_info, recid,
+                                        recommendations=None):
+        """Log a download, see :meth:`Obelix.log_download_after_search`."""
+        file_type = self._download_file_type(user_info)
+        if file_type is not None:
+            await self.log_page_view(user_info, recid,
+                                     req_type="events.downloads",
+                                     file_format=file_type,
+                                     recommendations=recommendations)
+
+    async def log_page_view(self, user_info, recid,
+                            req_type="events.pageviews", file_format="view",
+                            recommendations=None):
+        """Log a page view."""
+        uid = user_info.get('uid')
+        ip = user_info.get('remote_ip')
+        uri = user_info.get('uri')
+
+        await asyncio.gather(
+            self.log_page_view_for_neo_feeder(uid, recid, ip,
+                                              req_type, file_format),
+            self.log_page_view_for_analytics(uid, recid, ip, uri, req_type,
+                                             user_info=user_info,
+                                             recommendations=recommendations))
+
+    async def log_page_view_for_neo_feeder(self, uid, recid, remote_ip,
+                                           req_type, file_format):
+        """Feed the Obelix NeoFeeder with page views."""
+        data = self._neo_feeder_data(uid, recid, remote_ip,
+                                     req_type, file_format)
+        # goes to "logentries"
+        await self.send_to_obelix.save_to_neo_feeder(data)
+
+    async def log_page_view_for_analytics(self, uid, recid, ip, uri,
+                                          req_type, user_info=None,
+                                          recommendations=None):
+        """Store page view statistics."""
+        storage_key = self._page_view_key(uid)
+        if recommendations is None:
+            last_search_info, recommendations = await asyncio.gather(
+                self.cache.get(storage_key), self.get_recommendations(uid))
+        else:
+            last_search_info = await self.cache.get(storage_key)
+
+        if not last_search_info:
+            return
+        if recommendations is None:
+            recommendations = {}
+
+        for data in self._page_view_data(last_search_info, uid, recid, ip,
+                                         uri, req_type, user_info,
+                                         recommendations):
+            await self.send_to_obelix.statistics_page_view(data)
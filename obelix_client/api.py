@@ -20,10 +20,14 @@
 """Obelix-Client Search Engine."""
 
 import logging
+import multiprocessing
 import re
+import threading
 import time
 
-from . import utils
+from . import ranking, utils
+from .cache import LRUCache
+from .metrics import NullMetrics, clock
 
 
 CONFIG = {
@@ -34,10 +38,42 @@ CONFIG = {
     'score_min_multiply': 4,
     'score_one_result': 1,
     'method_switch_limit': 20,
+    'ranking_strategy': None,
     'user_identifier': 'uid',
+    'scoring_engine': 'python',
+    'ranked_cache_size': 128,
+    'ranked_cache_ttl': 300,
+    'ranked_cache_pages': 5,
+    'queue_batch_size': 1,
+    'queue_flush_interval': None,
+    'queue_mode': 'sync',
+    'queue_maxsize': 10000,
+    'queue_overflow': 'drop-oldest',
+    'queue_block_timeout': 1.0,
+    'recommendations_snapshot_size': 1024,
+    'recommendations_snapshot_ttl': 2,
+    'last_search_index': False,
+    'last_search_trim': False,
+    'last_search_ttl': None,
+    'compact_events': False,
+    'compact_user_info_keys': ('guest', 'referer', 'agent'),
 }
 
 
+_MISSING = object()
+
+
+class _SnapshotEntry(object):
+
+    """Recommendations of the snapshot, with their fingerprint once known."""
+
+    __slots__ = ('recommendations', 'fingerprint')
+
+    def __init__(self, recommendations):
+        self.recommendations = recommendations
+        self.fingerprint = _MISSING
+
+
 def get_logger():
     """Get a Logger."""
     return logging.getLogger('obelix_client')
@@ -45,55 +81,384 @@ def get_logger():
 
 class Obelix(object):
 
-    """Obelix-Client."""
+    """
+    Obelix-Client.
+
+    The ``metrics`` hook, see :mod:`obelix_client.metrics`, gets the
+    timings of the ranking stages, the queue pushes and the cache hits.
+    Give it to the :class:`~obelix_client.queue.RedisQueue` too for the
+    payload sizes.
+    """
 
     def __init__(self, cache_storage, recommendation_storage, queue_storage,
                  config=None,
-                 logger=None):
+                 logger=None, metrics=None):
         """Initialize the Obelix-Client connector."""
+        self._configure(cache_storage, recommendation_storage, queue_storage,
+                        config, logger, metrics)
+
+        self.cache.set("settings", self.config)
+        if self.config['compact_events']:
+            # Compact events reference the settings by their version
+            self.cache.set(self._settings_key(), self.config)
+
+    def _settings_key(self):
+        """Key of the settings of this version."""
+        return "settings::{0}".format(self.config_version)
+
+    def _configure(self, cache_storage, recommendation_storage,
+                   queue_storage, config, logger, metrics=None):
+        """Set up the storages and the config, without any I/O."""
         self.logger = logger or get_logger()
+        self.metrics = metrics or NullMetrics()
+        # Per thread, as the client is shared by the request threads
+        self._local = threading.local()
         self.recommendations = recommendation_storage
         self.cache = cache_storage
-        self.send_to_obelix = utils.SendToObelix(queue_storage)
         self.config = CONFIG.copy()
         if config is not None:
             self.config.update(config)
+        # Computed once, it is part of the key of every ranking
+        self.config_version = utils.config_version(self.config)
+        self.send_to_obelix = self._make_publisher(queue_storage)
+
+        # Ranked results, so that the next pages are a slice lookup
+        self.ranked_cache = LRUCache(self.config['ranked_cache_size'],
+                                     self.config['ranked_cache_ttl'])
+
+        # Recommendations fetched recently, shared by ranking and logging
+        self.recommendations_snapshot = LRUCache(
+            self.config['recommendations_snapshot_size'],
+            self.config['recommendations_snapshot_ttl'])
+
+    def _make_publisher(self, queue_storage):
+        """Create the publisher pushing the events to the queues."""
+        if self.config['queue_mode'] == 'background':
+            return utils.BackgroundSendToObelix(
+                queue_storage,
+                maxsize=self.config['queue_maxsize'],
+                overflow=self.config['queue_overflow'],
+                block_timeout=self.config['queue_block_timeout'],
+                metrics=self.metrics)
+
+        return utils.SendToObelix(
+            queue_storage,
+            batch_size=self.config['queue_batch_size'],
+            flush_interval=self.config['queue_flush_interval'],
+            metrics=self.metrics)
+
+    @property
+    def last_rank_seconds(self):
+        """Seconds the last :meth:`rank_records` of this thread took."""
+        return getattr(self._local, 'rank_seconds', None)
+
+    def report_metrics(self):
+        """Send the cache hit ratios and the publisher counters as gauges."""
+        caches = (('ranked', self.ranked_cache),
+                  ('recommendations', self.recommendations_snapshot),
+                  ('order_scores', utils.order_scores_memo),
+                  ('storage.cache', self.cache),
+                  ('storage.recommendations', self.recommendations))
+        for name, cache in caches:
+            if hasattr(cache, 'hit_ratio'):
+                self.metrics.gauge('cache.{0}.hit_ratio'.format(name),
+                                   cache.hit_ratio)
+
+        for counter in ('dropped', 'failed', 'pushed'):
+            if hasattr(self.send_to_obelix, counter):
+                self.metrics.gauge('queue.{0}'.format(counter),
+                                   getattr(self.send_to_obelix, counter))
+
+    def get_recommendations(self, user_id):
+        """
+        Get the recommendations of a user, None if there are none.
 
-        self.cache.set("settings", self.config)
+        The recommendations are kept in a short lived snapshot, so ranking
+        and logging the same request fetch and decode them only once.
+        """
+        entry = self.recommendations_snapshot.get(user_id, _MISSING)
+        if entry is _MISSING:
+            self.metrics.incr('cache.recommendations.miss')
+            entry = _SnapshotEntry(self.recommendations.get(user_id))
+            self.recommendations_snapshot.set(user_id, entry)
+        else:
+            self.metrics.incr('cache.recommendations.hit')
+        return entry.recommendations
 
-    def rank_records(self, hitset, user_id, rg=10, jrec=0):
+    def get_recommendations_many(self, user_ids):
+        """
+        Get the recommendations of several users in one round trip.
+
+        :return: dictionary {user_id: recommendations or None}
+        """
+        found, missing = self._snapshot_recommendations(user_ids)
+        if missing:
+            if hasattr(self.recommendations, 'get_many'):
+                fetched = self.recommendations.get_many(missing)
+            else:
+                fetched = [self.recommendations.get(user_id)
+                           for user_id in missing]
+            self._update_snapshot(found, missing, fetched)
+
+        return found
+
+    def _snapshot_recommendations(self, user_ids):
+        """
+        Look recommendations up in the snapshot.
+
+        :return: a tuple with the dictionary of the recommendations, the
+            missing ones included as placeholders, and the missing users
+        """
+        found = {}
+        missing = []
+        for user_id in user_ids:
+            if user_id in found:
+                continue
+            entry = self.recommendations_snapshot.get(user_id, _MISSING)
+            if entry is _MISSING:
+                found[user_id] = _MISSING
+                missing.append(user_id)
+            else:
+                found[user_id] = entry.recommendations
+        return found, missing
+
+    def _update_snapshot(self, found, missing, fetched):
+        """Keep the fetched recommendations of the missing users."""
+        for user_id, recommendations in zip(missing, fetched):
+            self.recommendations_snapshot.set(
+                user_id, _SnapshotEntry(recommendations))
+            found[user_id] = recommendations
+
+    def rank_records(self, hitset, user_id, rg=10, jrec=0,
+                     recommendations=None):
         """
         Rank a given search result based on recommendations.
 
         Expects the hitset to be sorted by latest last [1,2,3,4,5] (recids)
+
+        Sequences, i.e. lists, ``range`` or ``array.array``, are walked
+        from the end without being copied, other iterables are read once.
+        ``intbitset`` and sorted arrays are ranked scoring only their
+        recommended records and the records up to the requested pages,
+        see :func:`~obelix_client.hitset.as_hitset`. Arrays are checked
+        to be sorted with NumPy; pass them wrapped in a
+        :class:`~obelix_client.hitset.SortedHitset` to skip the check, or
+        to rank them so without NumPy.
+
+        To rank many hitsets at once see :meth:`rank_records_batch`.
+
+        Set ``scoring_engine`` to ``'numpy'`` in the config to score with
+        the array based engine, the pure Python engine is used when NumPy
+        is not installed. Above ``method_switch_limit`` hits, the Python
+        engine walks the recommendations instead of the hits when they
+        are fewer, see :mod:`obelix_client.ranking`.
+
+        Ranked results are cached per user, hitset, config and
+        recommendations, so loading the next page is a slice lookup.
+
+        The time taken is kept in :attr:`last_rank_seconds`, the stages
+        are timed by the metrics hook.
+
+        :param recommendations: recommendations of the user if they were
+            already fetched, see :meth:`get_recommendations`
         :return:
             A tuple, one list with records and one with scores.
             The list of records are integers while the scores are floats:
                 [1,2,3],[.9,.8,7] etc...
         """
-        hitset = list(hitset)
-        hitset.reverse()
-        jrec = max(jrec - 1, 0)
-        # TODO: Maybe cache ranked result, if the next page is loaded
-        records_by_order = utils.rank_records_by_order(self.config, hitset)
+        start = clock()
+        with self.metrics.timer('rank.reverse'):
+            hitset = utils.as_hitset(hitset)
 
         # Get Recommendations from storage
-        recommendations = self.recommendations.get(user_id)
+        if recommendations is None:
+            with self.metrics.timer('rank.fetch'):
+                recommendations = self.get_recommendations(user_id)
 
-        # If the user does not have any recommendations, we can just return
-        if (recommendations is None or
-                self.config['recommendations_impact'] == 0):
-            final_scores = records_by_order
-        else:
-            # Calculate scores
-            final_scores = utils.calc_scores(self.config,
-                                             records_by_order,
-                                             recommendations)
+        page = self._rank_page(hitset, user_id, recommendations, rg, jrec)
+        self._rank_done(start)
+        return page
+
+    def rank_records_batch(self, requests, processes=None):
+        """
+        Rank many search results at once, i.e. for offline evaluation.
 
-        records, scores = utils.sort_records_by_score(final_scores)
+        The recommendations of all the users are fetched in one round
+        trip and the order scores are computed once per hitset size. With
+        ``processes`` above one, the rankings missing from the ranked
+        cache are spread over a pool of that many processes, which pays
+        off for large batches only.
 
+        :param requests: iterable of (hitset, user_id[, rg[, jrec]])
+            tuples, the arguments of :meth:`rank_records`
+        :return: list of the (records, scores) pages, in request order
+        """
+        requests = [self._batch_request(*request) for request in requests]
+        recommendations = self.get_recommendations_many(
+            [user_id for _, user_id, _, _ in requests])
+        return self._rank_batch(requests, recommendations, processes)
+
+    def _rank_batch(self, requests, recommendations, processes):
+        """Rank the batch requests with the fetched recommendations."""
+        if self.ranked_cache.maxsize <= 0:
+            return self._rank_batch_uncached(requests, recommendations,
+                                             processes)
+
+        pages = []
+        # Rankings to compute, requests of the same ranking share it
+        jobs = []
+        pending = {}
+        for hitset, user_id, rg, jrec in requests:
+            hitset = utils.as_hitset(hitset)
+            jrec = max(jrec - 1, 0)
+            user_recommendations = self._ranking_recommendations(
+                recommendations[user_id])
+            cache_key = self._ranked_key(hitset, user_id,
+                                         user_recommendations)
+            page = self._cached_page(cache_key, rg, jrec)
+            if page is None:
+                limit = self._rank_limit(rg, jrec)
+                if cache_key not in pending:
+                    pending[cache_key] = (len(jobs), [])
+                    jobs.append([hitset, user_recommendations, limit])
+                index, waiting = pending[cache_key]
+                jobs[index][2] = max(jobs[index][2], limit)
+                waiting.append((len(pages), rg, jrec))
+            pages.append(page)
+
+        ranked = self._rank_many(jobs, processes)
+        for cache_key, (index, waiting) in pending.items():
+            records, scores = ranked[index]
+            for position, rg, jrec in waiting:
+                pages[position] = self._store_ranked(
+                    cache_key, records, scores, jobs[index][2], rg, jrec)
+
+        return pages
+
+    def _rank_batch_uncached(self, requests, recommendations, processes):
+        """Rank the batch requests one by one, without the ranked cache."""
+        jobs = []
+        starts = []
+        for hitset, user_id, rg, jrec in requests:
+            jrec = max(jrec - 1, 0)
+            jobs.append((utils.as_hitset(hitset),
+                         self._ranking_recommendations(
+                             recommendations[user_id]),
+                         jrec + rg))
+            starts.append(jrec)
+
+        return [(records[jrec:], scores[jrec:])
+                for (records, scores), jrec
+                in zip(self._rank_many(jobs, processes), starts)]
+
+    @staticmethod
+    def _batch_request(hitset, user_id, rg=10, jrec=0):
+        """Fill in the defaults of a :meth:`rank_records_batch` request."""
+        return hitset, user_id, rg, jrec
+
+    def _rank_many(self, jobs, processes):
+        """Rank (hitset, recommendations, limit) jobs, maybe in a pool."""
+        if not processes or processes <= 1 or len(jobs) < 2:
+            return ranking.rank_hitsets(self.config, jobs)
+
+        # A few chunks per process, for an even load
+        size = -(-len(jobs) // (processes * 4))
+        chunks = [(self.config, jobs[start:start + size])
+                  for start in range(0, len(jobs), size)]
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(ranking._rank_hitsets_job, chunks)
+        finally:
+            pool.close()
+            pool.join()
+        return [ranked for chunk in results for ranked in chunk]
+
+    def _rank_done(self, start):
+        """Record the time taken by a ranking started at ``start``."""
+        seconds = clock() - start
+        self._local.rank_seconds = seconds
+        self.metrics.timing('rank.total', seconds)
+
+    def _rank_page(self, hitset, user_id, recommendations, rg, jrec):
+        """Rank the reversed hitset and return the requested page."""
+        jrec = max(jrec - 1, 0)
+        recommendations = self._ranking_recommendations(recommendations)
+
+        if self.ranked_cache.maxsize <= 0:
+            # Without the cache, no key to build and no page ahead to rank
+            records, scores = self._rank(hitset, recommendations, jrec + rg)
+            return records[jrec:], scores[jrec:]
+
+        cache_key = self._ranked_key(hitset, user_id, recommendations)
+        page = self._cached_page(cache_key, rg, jrec)
+        if page is not None:
+            return page
+
+        limit = self._rank_limit(rg, jrec)
+        records, scores = self._rank(hitset, recommendations, limit)
+        return self._store_ranked(cache_key, records, scores, limit, rg,
+                                  jrec)
+
+    def _ranking_recommendations(self, recommendations):
+        """Recommendations used to rank, None if they have no impact."""
+        # If the user does not have any recommendations, the order is enough
+        if self.config['recommendations_impact'] == 0:
+            return None
+        return recommendations
+
+    def _ranked_key(self, hitset, user_id, recommendations):
+        """Key of a ranking in the ranked cache."""
+        return (user_id,
+                utils.hitset_fingerprint(hitset),
+                self.config_version,
+                self._recommendations_fingerprint(user_id, recommendations))
+
+    def _recommendations_fingerprint(self, user_id, recommendations):
+        """
+        Fingerprint of the recommendations of a user.
+
+        Computed once per fetch, it is kept with the recommendations in
+        the snapshot.
+        """
+        entry = self.recommendations_snapshot.peek(user_id)
+        if entry is None or entry.recommendations is not recommendations:
+            return utils.recommendations_fingerprint(recommendations)
+        if entry.fingerprint is _MISSING:
+            entry.fingerprint = utils.recommendations_fingerprint(
+                recommendations)
+        return entry.fingerprint
+
+    def _cached_page(self, cache_key, rg, jrec):
+        """Get a page from the ranked cache, None if it is not there."""
+        cached = self.ranked_cache.get(cache_key)
+        if cached is not None:
+            records, scores, complete = cached
+            if complete or len(records) >= jrec + rg:
+                self.metrics.incr('cache.ranked.hit')
+                return records[jrec:jrec + rg], scores[jrec:jrec + rg]
+        self.metrics.incr('cache.ranked.miss')
+        return None
+
+    def _rank_limit(self, rg, jrec):
+        """Number of records to rank for a page."""
+        # Rank a few pages ahead, they are likely to be loaded next
+        return jrec + rg * max(self.config['ranked_cache_pages'], 1)
+
+    def _store_ranked(self, cache_key, records, scores, limit, rg, jrec):
+        """Cache a ranking and return the requested page of it."""
+        self.ranked_cache.set(cache_key,
+                              (records, scores, len(records) < limit))
         return records[jrec:jrec + rg], scores[jrec:jrec + rg]
 
+    def _rank(self, hitset, recommendations, limit):
+        """Score the reversed hitset and select the ``limit`` best records."""
+        return ranking.rank_hitset(self.config, hitset, recommendations,
+                                   limit, metrics=self.metrics)
+
+    def flush(self):
+        """Push the events buffered by the queue publisher."""
+        self.send_to_obelix.flush()
+
     def log(self, action, *args, **kwargs):
         """Forward the log event."""
         return getattr(self, 'log_' + action)(*args, **kwargs)
@@ -101,7 +466,8 @@ class Obelix(object):
     def log_search_result(self, user_info, original_result_ordered,
                           record_ids, results_final_colls_scores,
                           cols_in_result_ordered,
-                          seconds_to_rank_and_print, jrec, rg, rm, cc):
+                          seconds_to_rank_and_print, jrec, rg, rm, cc,
+                          recommendations=None):
         """
         Log a search result, used for statistics and to lookup last search.
 
@@ -110,25 +476,86 @@ class Obelix(object):
         :param record_ids:
         :param results_final_colls_scores:
         :param cols_in_result_ordered:
-        :param seconds_to_rank_and_print:
+        :param seconds_to_rank_and_print: None for the time the last
+            :meth:`rank_records` of this thread took
         :param jrec:
         :param rg:
         :param rm:
         :param cc:
+        :param recommendations: recommendations of the user if they were
+            already fetched, see :meth:`get_recommendations`
         :return:
         """
         uid = user_info.get(self.config['user_identifier'])
+        if recommendations is None:
+            recommendations = self.get_recommendations(uid)
+        last_searches, data = self._search_result_data(
+            user_info, original_result_ordered, record_ids,
+            results_final_colls_scores, cols_in_result_ordered,
+            seconds_to_rank_and_print, jrec, rg, rm, cc, recommendations)
+
+        for storage_key, last_search in last_searches.items():
+            self._set_last_search(storage_key, last_search)
+        self.send_to_obelix.statistics_search_result(data)
+
+    def _set_last_search(self, storage_key, last_search):
+        """Store a last search record, with a TTL only if one is set."""
+        if self.config['last_search_ttl'] is None:
+            # Cache storages are not required to take a TTL
+            return self.cache.set(storage_key, last_search)
+        return self.cache.set(storage_key, last_search,
+                              self.config['last_search_ttl'])
+
+    def _search_result_data(self, user_info, original_result_ordered,
+                            record_ids, results_final_colls_scores,
+                            cols_in_result_ordered,
+                            seconds_to_rank_and_print, jrec, rg, rm, cc,
+                            recommendations):
+        """
+        Build the last search records and the search statistics event.
+
+        With ``last_search_index``, the hits of the shown records are
+        indexed in a record of their own, so that page views neither
+        decode nor scan the whole results.
+
+        :return: a tuple with a dictionary of the last search records by
+            storage key and the statistics event
+        """
+        uid = user_info.get(self.config['user_identifier'])
         search_timestamp = time.time()
+        if seconds_to_rank_and_print is None:
+            seconds_to_rank_and_print = self.last_rank_seconds
 
         # Store the current search to use with page views later
-        data = {'search_timestamp': search_timestamp,
-                'record_ids': record_ids,
-                'jrec': jrec,
-                'rm': rm,
-                'rg': rg,
-                'cc': cc}
-        storage_key = "{0}::{1}".format("last-search-result", uid)
-        self.cache.set(storage_key, data)
+        last_search = {'search_timestamp': search_timestamp,
+                       'record_ids': record_ids,
+                       'jrec': jrec,
+                       'rm': rm,
+                       'rg': rg,
+                       'cc': cc}
+        # Only the shown records can be viewed after the search
+        windows, offsets, counts = utils.trim_record_ids(
+            record_ids, max(jrec - 1, 0), rg)
+        record_index = None
+        if self.config['last_search_trim'] or \
+                self.config['last_search_index']:
+            # Hits numbered in all the results, which are not kept
+            record_index = utils.build_hit_index(record_ids,
+                                                 max(jrec - 1, 0), rg)
+        if self.config['last_search_trim']:
+            last_search.update({'record_ids': windows,
+                                'record_offsets': offsets,
+                                'record_counts': counts,
+                                'record_index': record_index})
+        last_searches = {
+            "{0}::{1}".format("last-search-result", uid): last_search}
+        if self.config['last_search_index']:
+            # Page views look their hits up instead of scanning the results
+            page = dict((key, value) for key, value in last_search.items()
+                        if key not in ('record_ids', 'record_offsets',
+                                       'record_counts'))
+            page['record_index'] = record_index
+            last_searches["{0}::{1}".format("last-search-page", uid)] = page
 
         # Store search result for statistics
         data = {'obelix_redis': "CFG_WEBSEARCH_OBELIX_REDIS",
@@ -141,16 +568,28 @@ class Obelix(object):
                 'uri': user_info.get('uri'),
                 'timestamp': search_timestamp,
                 'settings': self.config,
-                'recommendations': self.recommendations.get(uid),
+                'recommendations': utils.recommendations_as_dict(
+                    recommendations),
                 'seconds_to_rank_and_print': seconds_to_rank_and_print,
                 'cols_in_result_ordered': cols_in_result_ordered,
                 'jrec': jrec,
                 'rg': rg,
                 'rm': rm,
                 'cc': cc}
-        self.send_to_obelix.statistics_search_result(data)
 
-    def log_page_view_after_search(self, user_info, recid):
+        if self.config['compact_events']:
+            # Versions instead of the full settings and recommendations
+            del data['settings']
+            data['settings_version'] = self.config_version
+            data['recommendations'] = utils.recommendations_subset(
+                recommendations, windows)
+            data['recommendations_version'] = utils.recommendations_version(
+                recommendations)
+
+        return last_searches, data
+
+    def log_page_view_after_search(self, user_info, recid,
+                                   recommendations=None):
         """
         Log a page view.
 
@@ -161,9 +600,11 @@ class Obelix(object):
         """
         self.log_page_view(user_info, recid,
                            req_type="events.pageviews",
-                           file_format="page_view")
+                           file_format="page_view",
+                           recommendations=recommendations)
 
-    def log_download_after_search(self, user_info, recid):
+    def log_download_after_search(self, user_info, recid,
+                                  recommendations=None):
         """
         Log a download.
 
@@ -173,20 +614,27 @@ class Obelix(object):
         :param recid:
         :return:
         """
+        file_type = self._download_file_type(user_info)
+        if file_type is not None:
+            self.log_page_view(user_info, recid,
+                               req_type="events.downloads",
+                               file_format=file_type,
+                               recommendations=recommendations)
+
+    @staticmethod
+    def _download_file_type(user_info):
+        """Get the file type of a download, None if it is not one."""
         # if 'uri' in user_info and '.pdf' in user_info['uri'].lower():
         if 'uri' in user_info and 'subformat=' not in user_info['uri'].lower():
             try:
-                file_type = re.search(r'\.\D+', user_info['uri']).group()[1:]
+                return re.search(r'\.\D+', user_info['uri']).group()[1:]
             except AttributeError:
                 # No file type, i.e. uri = '/record/394122/files/?'
                 pass
-            else:
-                self.log_page_view(user_info, recid,
-                                   req_type="events.downloads",
-                                   file_format=file_type)
+        return None
 
     def log_page_view(self, user_info, recid, req_type="events.pageviews",
-                      file_format="view"):
+                      file_format="view", recommendations=None):
         """Log a page view."""
         uid = user_info.get('uid')
         ip = user_info.get('remote_ip')
@@ -195,7 +643,8 @@ class Obelix(object):
         self.log_page_view_for_neo_feeder(uid, recid, ip,
                                           req_type, file_format)
         self.log_page_view_for_analytics(uid, recid, ip, uri, req_type,
-                                         user_info=user_info)
+                                         user_info=user_info,
+                                         recommendations=recommendations)
 
     def log_page_view_for_neo_feeder(self, uid, recid, remote_ip,
                                      req_type, file_format):
@@ -206,7 +655,15 @@ class Obelix(object):
         :param recid:
         :return: None
         """
-        data = {
+        data = self._neo_feeder_data(uid, recid, remote_ip,
+                                     req_type, file_format)
+        # goes to "logentries"
+        self.send_to_obelix.save_to_neo_feeder(data)
+
+    @staticmethod
+    def _neo_feeder_data(uid, recid, remote_ip, req_type, file_format):
+        """Build the page view event for the NeoFeeder."""
+        return {
             'item': recid,
             'ip': remote_ip,
             "type": req_type,
@@ -214,54 +671,85 @@ class Obelix(object):
             'file_format': file_format,
             "timestamp": time.time()
         }
-        # goes to "logentries"
-        self.send_to_obelix.save_to_neo_feeder(data)
 
     def log_page_view_for_analytics(self, uid, recid, ip, uri, req_type,
-                                    user_info=None):
+                                    user_info=None, recommendations=None):
         """Mainly used to store statistics, may be removed in the future.
 
         :param uid:
         :param recid:
         :param ip:
         :param uri:
+        :param recommendations: recommendations of the user if they were
+            already fetched, see :meth:`get_recommendations`
         :return:
         """
-        storage_key = "{0}::{1}".format("last-search-result", uid)
+        storage_key = self._page_view_key(uid)
         last_search_info = self.cache.get(storage_key)
 
         if not last_search_info:
             return
 
-        hit_number_global = 0
-        for collection_result in last_search_info['record_ids']:
-            if recid in collection_result:
-                hit_number_local = collection_result.index(recid)
-                hit_number_global += hit_number_local
-
-                timestamp = last_search_info['search_timestamp']
-                jrec = last_search_info['jrec']
-                rg = last_search_info['rg']
-                rm = last_search_info['rm']
-                cc = last_search_info['cc']
-
-                recommendations = self.recommendations.get(uid, {})
-                data = {'search_timestamp': timestamp,
-                        'recid': recid,
-                        'timestamp': time.time(),
-                        'uid': uid,
-                        'remote_ip': ip,
-                        'uri': uri,
-                        'jrec': jrec,
-                        'rg': rg,
-                        'rm': rm,
-                        'cc': cc,
-                        'hit_number_local': jrec + hit_number_local,
-                        'hit_number_global': jrec + hit_number_global,
-                        'recommendations': recommendations,
-                        'recid_in_recommendations': recid in recommendations,
-                        'type': req_type,
-                        'user_info': user_info}
-                self.send_to_obelix.statistics_page_view(data)
-
-            hit_number_global += len(collection_result)
+        if recommendations is None:
+            recommendations = self.get_recommendations(uid) or {}
+
+        for data in self._page_view_data(last_search_info, uid, recid, ip,
+                                         uri, req_type, user_info,
+                                         recommendations):
+            self.send_to_obelix.statistics_page_view(data)
+
+    def _page_view_key(self, uid):
+        """Key of the last search record page views read."""
+        if self.config['last_search_index']:
+            return "{0}::{1}".format("last-search-page", uid)
+        return "{0}::{1}".format("last-search-result", uid)
+
+    def _page_view_data(self, last_search_info, uid, recid, ip, uri,
+                        req_type, user_info, recommendations):
+        """Build the page view statistics events, one per hit collection."""
+        if self.config['compact_events']:
+            recommendations_version = utils.recommendations_version(
+                recommendations)
+            recommendations_dict = utils.recommendations_subset(
+                recommendations, [[recid]])
+            user_info = dict(
+                (key, value) for key, value in (user_info or {}).items()
+                if key in self.config['compact_user_info_keys'])
+        else:
+            recommendations_dict = utils.recommendations_as_dict(
+                recommendations)
+
+        record_index = last_search_info.get('record_index')
+        if record_index is not None:
+            hits = record_index.get(str(recid), ())
+        else:
+            hits = utils.find_hits(last_search_info['record_ids'], recid,
+                                   last_search_info.get('record_offsets'),
+                                   last_search_info.get('record_counts'))
+
+        for _, hit_number_local, hit_number_global in hits:
+            timestamp = last_search_info['search_timestamp']
+            jrec = last_search_info['jrec']
+            rg = last_search_info['rg']
+            rm = last_search_info['rm']
+            cc = last_search_info['cc']
+
+            data = {'search_timestamp': timestamp,
+                    'recid': recid,
+                    'timestamp': time.time(),
+                    'uid': uid,
+                    'remote_ip': ip,
+                    'uri': uri,
+                    'jrec': jrec,
+                    'rg': rg,
+                    'rm': rm,
+                    'cc': cc,
+                    'hit_number_local': jrec + hit_number_local,
+                    'hit_number_global': jrec + hit_number_global,
+                    'recommendations': recommendations_dict,
+                    'recid_in_recommendations': recid in recommendations,
+                    'type': req_type,
+                    'user_info': user_info}
+            if self.config['compact_events']:
+                data['recommendations_version'] = recommendations_version
+            yield data
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Obelix-Client in-process caches."""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+
+    """
+    Size bounded LRU cache with an optional time to live.
+
+    Keeps hit and miss counters, used to report the cache efficiency.
+    Safe to share between threads.
+    """
+
+    def __init__(self, maxsize=128, ttl=None, timer=time.time, sizeof=None):
+        """
+        Initialize the cache.
+
+        :maxsize: maximum size of the entries, the least recently used
+            entries are evicted when it is reached
+        :ttl: seconds an entry stays valid, None to never expire
+        :sizeof: function giving the size of a value, every entry counts
+            as one by default
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of entries, including expired ones not yet evicted."""
+        return len(self._data)
+
+    def __contains__(self, key):
+        """Check if a valid entry exists, without counting it."""
+        try:
+            expires, _ = self._data[key]
+        except KeyError:
+            return False
+        return expires is None or expires > self.timer()
+
+    def get(self, key, default=None):
+        """Get a key, moving it to the most recently used position."""
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires is not None and expires <= self.timer():
+                self.size -= self._sizeof(value)
+                self.misses += 1
+                return default
+
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """Get a key without counting it nor moving it."""
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            return default
+        if expires is not None and expires <= self.timer():
+            return default
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Set a key, value pair, ``ttl`` overrides the default one."""
+        if self.maxsize <= 0:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        expires = self.timer() + ttl if ttl is not None else None
+        size = self._sizeof(value)
+
+        with self._lock:
+            self._pop(key)
+            if size > self.maxsize:
+                return
+            self._purge()
+            while self.size + size > self.maxsize:
+                self._pop(next(iter(self._data)))
+            self._data[key] = (expires, value)
+            self.size += size
+
+    def _sizeof(self, value):
+        """Size of a value."""
+        return self.sizeof(value) if self.sizeof is not None else 1
+
+    def _pop(self, key):
+        """Remove a key, the lock has to be held."""
+        try:
+            _, value = self._data.pop(key)
+        except KeyError:
+            return
+        self.size -= self._sizeof(value)
+
+    def _purge(self):
+        """Evict the expired entries from the least recently used end."""
+        now = self.timer()
+        while self._data:
+            key = next(iter(self._data))
+            expires = self._data[key][0]
+            if expires is None or expires > now:
+                break
+            self._pop(key)
+
+    def delete(self, key):
+        """Remove a key."""
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        """Remove all entries, the counters are kept."""
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    @property
+    def hit_ratio(self):
+        """Ratio of lookups answered from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits * 1.0 / lookups if lookups else 0.0
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Obelix-Client encoders.
+
+Encoders for :class:`~obelix_client.storage.StorageProxy` and
+:class:`~obelix_client.queue.RedisQueue`, objects with ``dumps`` and
+``loads``. ``loads`` accepts bytes as well as a memoryview of them, and
+decodes without copying the data first where the backend allows it.
+"""
+
+import json
+import struct
+import sys
+from array import array
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+def _int64_typecode():
+    """Array typecode of int64, Python 2 has no 'q' but a 64-bit 'l'."""
+    for typecode in ('q', 'l'):
+        try:
+            if array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            pass
+    return None  # pragma: no cover
+
+
+#: Array typecode of the int64 recids of the binary formats, None on
+#: Python 2 where long is 32-bit, i.e. Windows
+INT64_TYPECODE = _int64_typecode()
+
+
+def int64_array(values=()):
+    """Array of int64 values, for the binary formats."""
+    if INT64_TYPECODE is None:  # pragma: no cover
+        raise ValueError("No 64-bit integer array type on this platform")
+    return array(INT64_TYPECODE, values)
+
+
+def _json_backends():
+    """Available JSON libraries, the fastest first."""
+    for name in ('orjson', 'ujson', 'simplejson'):
+        try:
+            yield __import__(name)
+        except ImportError:
+            pass
+    yield json
+
+
+class MsgpackEncoder(object):
+
+    """
+    Msgpack encoder.
+
+    Strings and bytes stay apart (``use_bin_type``) and integer map keys,
+    i.e. the recids of recommendations, are accepted.
+    """
+
+    name = 'msgpack'
+
+    def __init__(self):
+        """Initialize the encoder, msgpack has to be installed."""
+        if msgpack is None:
+            raise ImportError("msgpack is not installed")
+        self._options = {'raw': False}
+        try:
+            msgpack.unpackb(msgpack.packb({1: 1}), strict_map_key=False)
+        except TypeError:
+            # Before msgpack 1.0, map keys are not checked
+            pass
+        else:
+            self._options['strict_map_key'] = False
+
+    @staticmethod
+    def dumps(value):
+        """Encode a value."""
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        """Decode bytes or a memoryview."""
+        return msgpack.unpackb(data, **self._options)
+
+
+class JsonEncoder(object):
+
+    """
+    JSON encoder, using the fastest JSON library installed.
+
+    orjson, ujson and simplejson are preferred to the standard library.
+    Like with the standard library, integer map keys come back as strings.
+    """
+
+    def __init__(self, backend=None):
+        """Initialize the encoder, ``backend`` forces a JSON library."""
+        self.backend = backend or next(_json_backends())
+        self.name = 'json ({0})'.format(self.backend.__name__)
+        if self.backend.__name__ == 'orjson':
+            self._options = self.backend.OPT_NON_STR_KEYS
+        else:
+            self._options = None
+
+    def dumps(self, value):
+        """Encode a value, to bytes or str depending on the backend."""
+        if self._options is not None:
+            return self.backend.dumps(value, option=self._options)
+        return self.backend.dumps(value)
+
+    def loads(self, data):
+        """Decode bytes, str or a memoryview."""
+        if isinstance(data, memoryview) and self._options is None:
+            # Only orjson reads buffers
+            data = data.tobytes()
+        return self.backend.loads(data)
+
+
+class RecidListEncoder(object):
+
+    """
+    Encoder specialised for lists of recids.
+
+    Recids are stored as little-endian int64 after a count. Decoding
+    returns a read-only sequence of the recids viewing the encoded data,
+    supporting ``len``, ``in``, indexing and iteration, without building
+    a list.
+    """
+
+    name = 'recid-list'
+
+    _header = struct.Struct('<I')
+
+    def dumps(self, recids):
+        """Encode a list of integer recids."""
+        values = int64_array(recids)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return self._header.pack(len(values)) + array_bytes(values)
+
+    def loads(self, data):
+        """Decode to a sequence of recids, viewing ``data`` if possible."""
+        size, = self._header.unpack_from(data)
+        start = self._header.size
+        return typed_view(data, start, start + size * 8, INT64_TYPECODE)
+
+
+def get_encoder(name=None):
+    """
+    Get a built-in encoder.
+
+    :param name: ``'msgpack'``, ``'json'`` or ``'recid-list'``; msgpack
+        by default, JSON if msgpack is not installed
+    """
+    if name is None:
+        name = 'msgpack' if msgpack is not None else 'json'
+
+    if name == 'msgpack':
+        return MsgpackEncoder()
+    elif name == 'json':
+        return JsonEncoder()
+    elif name == 'recid-list':
+        return RecidListEncoder()
+    raise ValueError("Unknown encoder: {0}".format(name))
+
+
+def array_bytes(values):
+    """Bytes of an array."""
+    try:
+        return values.tobytes()
+    except AttributeError:  # pragma: no cover
+        return values.tostring()
+
+
+def typed_view(data, start, end, typecode):
+    """
+    Typed view on a little-endian part of a buffer.
+
+    A memoryview cast avoids copying the data, an array copy is used where
+    it is not available or the byte order does not match.
+    """
+    if sys.byteorder == 'little' and hasattr(memoryview, 'cast'):
+        return memoryview(data)[start:end].cast('B').cast(typecode)
+
+    values = array(typecode)
+    chunk = data[start:end]
+    try:
+        values.frombytes(chunk)
+    except AttributeError:  # pragma: no cover
+        if isinstance(chunk, memoryview):
+            chunk = chunk.tobytes()
+        values.fromstring(chunk)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Obelix-Client hitsets.
+
+Search results come sorted by latest last, ranking walks them from the
+end through a :class:`ReversedHitset` view instead of copying them.
+
+Invenio hands them as ``intbitset`` or sorted integer arrays, which
+:func:`as_hitset` wraps in a :class:`SortedHitset`: its recommended
+records are found by looking the recommended recids up in the hitset,
+instead of looking every record up in the recommendations.
+
+Checking that a buffer is sorted takes a NumPy pass over it; callers
+that know their records are sorted can pass a :class:`SortedHitset`
+they built themselves to skip it.
+"""
+
+import hashlib
+from bisect import bisect_left
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+try:
+    from intbitset import intbitset
+except ImportError:  # pragma: no cover
+    intbitset = None
+
+try:
+    _RANGE = xrange
+except NameError:
+    _RANGE = range
+
+#: Buffer formats of integers, in native byte order
+_INT_FORMATS = frozenset('bBhHiIlLqQnN')
+
+#: Python 2 memoryviews index bytes, not integers
+_TYPED_VIEWS = hasattr(memoryview, 'cast')
+
+
+class ReversedHitset(object):
+
+    """
+    Read-only view of a hitset in ranking order, the latest record first.
+
+    Search results come sorted by latest last, the view walks them from
+    the end instead of copying them.
+    """
+
+    __slots__ = ('hitset',)
+
+    def __init__(self, hitset):
+        self.hitset = hitset
+
+    def __reduce__(self):
+        """Pickle the wrapped hitset, Python 2 can not pickle slots."""
+        return ReversedHitset, (self.hitset,)
+
+    def __len__(self):
+        """Number of records."""
+        return len(self.hitset)
+
+    def __iter__(self):
+        """Iterate from the latest record."""
+        return reversed(self.hitset)
+
+    def __getitem__(self, index):
+        """Get a record by its ranking position, or a list of a slice."""
+        size = len(self.hitset)
+        if isinstance(index, slice):
+            return [self.hitset[size - 1 - position]
+                    for position in range(*index.indices(size))]
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("hitset index out of range")
+        return self.hitset[size - 1 - index]
+
+
+class SortedHitset(ReversedHitset):
+
+    """
+    Ranking order view of unique recids sorted in ascending order.
+
+    Wraps an ``intbitset`` or a sorted buffer of integers, i.e. an
+    ``array.array`` or a NumPy array, without copying the buffers.
+    Positions are found with a binary search. Bitsets can not be walked
+    backwards, they are read once with their native ``tolist``. On
+    Python 2, sequences are wrapped as they are.
+    """
+
+    __slots__ = ('source', 'bitset')
+
+    def __init__(self, hitset):
+        self.source = hitset
+        self.bitset = None
+        if intbitset is not None and isinstance(hitset, intbitset):
+            self.bitset = hitset
+            hitset = hitset.tolist()
+        elif not isinstance(hitset, _RANGE) and _TYPED_VIEWS:
+            # Iterates over Python integers, even for NumPy arrays
+            hitset = memoryview(hitset)
+        super(SortedHitset, self).__init__(hitset)
+
+    def __reduce__(self):
+        """Pickle the wrapped hitset, i.e. to send it to a process pool."""
+        return SortedHitset, (self.source,)
+
+    @property
+    def fingerprint(self):
+        """
+        Fingerprint of the records, hashing the buffers as a whole.
+
+        :return: the fingerprint, None if the records have to be walked
+        """
+        if isinstance(self.source, _RANGE):
+            return len(self), repr(self.source)
+        elif self.bitset is not None:
+            return (len(self), 'intbitset',
+                    hashlib.md5(self.bitset.fastdump()).hexdigest())
+        elif isinstance(self.hitset, memoryview) and \
+                self.hitset.c_contiguous:
+            return (len(self), self.hitset.format,
+                    hashlib.md5(self.hitset.cast('B')).hexdigest())
+        return None
+
+    def __contains__(self, recid):
+        """Check if a record is in the hitset."""
+        if self.bitset is not None:
+            try:
+                return recid in self.bitset
+            except (TypeError, ValueError, OverflowError):
+                return False
+        return self.position(recid) is not None
+
+    def position(self, recid):
+        """Ranking position of a record, None if it is not in the hitset."""
+        try:
+            index = bisect_left(self.hitset, recid)
+        except TypeError:
+            return None
+        if index < len(self.hitset) and self.hitset[index] == recid:
+            return len(self.hitset) - 1 - index
+        return None
+
+    def intersection(self, recids):
+        """
+        Find the records of the hitset among ``recids``.
+
+        :param recids: iterable of recids, i.e. the recommended ones
+        :return: list of (position, recid) tuples, by ranking position
+        """
+        found = []
+        for recid in recids:
+            if self.bitset is not None and recid not in self:
+                continue
+            position = self.position(recid)
+            if position is not None:
+                found.append((position, recid))
+        found.sort()
+        return found
+
+
+def reversed_hitset(hitset):
+    """
+    View a search result in ranking order, the latest record first.
+
+    Sequences, i.e. lists, ``range`` or ``array.array``, are not copied,
+    other iterables are read into a list once.
+
+    :return: :class:`ReversedHitset`
+    """
+    if isinstance(hitset, ReversedHitset):
+        return hitset
+    if not (hasattr(hitset, '__reversed__') or
+            (hasattr(hitset, '__len__') and hasattr(hitset, '__getitem__'))):
+        hitset = list(hitset)
+    return ReversedHitset(hitset)
+
+
+def as_hitset(hitset):
+    """
+    View a search result in ranking order, sorted ones as such.
+
+    ``intbitset``, increasing ``range`` and buffers of strictly increasing
+    integers give a :class:`SortedHitset`, anything else the view of
+    :func:`reversed_hitset`. Buffers are checked with NumPy, without it
+    they are ranked as other sequences. A :class:`SortedHitset` is used
+    as it is, its records are not checked again.
+    """
+    if isinstance(hitset, ReversedHitset):
+        return hitset
+    if intbitset is not None and isinstance(hitset, intbitset):
+        return SortedHitset(hitset)
+    if isinstance(hitset, _RANGE):
+        if getattr(hitset, 'step', 0) > 0:
+            return SortedHitset(hitset)
+    elif _is_sorted_buffer(hitset):
+        return SortedHitset(hitset)
+    return reversed_hitset(hitset)
+
+
+def _is_sorted_buffer(hitset):
+    """Check if a hitset is a buffer of strictly increasing integers."""
+    # A Python loop over every record costs more than it saves
+    if numpy is None or not _TYPED_VIEWS:
+        return False
+    try:
+        view = memoryview(hitset)
+    except TypeError:
+        return False
+    # Views only index the native formats, explicit byte orders included
+    if view.ndim != 1 or view.format.lstrip('@') not in _INT_FORMATS:
+        return False
+
+    records = numpy.asarray(view)
+    return bool(numpy.all(records[1:] > records[:-1]))
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Obelix-Client metrics hooks."""
+
+import time
+
+#: Clock used for the timings
+clock = getattr(time, 'perf_counter', time.time)
+
+
+class NullMetrics(object):
+
+    """
+    Metrics hook doing nothing, used when no metrics are configured.
+
+    Other hooks implement ``incr``, ``gauge`` and ``timing``, timings are
+    in seconds. Names are dotted, i.e. ``rank.order``.
+    """
+
+    enabled = False
+
+    def incr(self, name, value=1):
+        """Increment a counter."""
+
+    def gauge(self, name, value):
+        """Set a gauge."""
+
+    def timing(self, name, seconds):
+        """Record a duration, in seconds."""
+
+    def timer(self, name):
+        """Context manager recording the duration of its block."""
+        return _NULL_TIMER
+
+
+class CallbackMetrics(NullMetrics):
+
+    """
+    Metrics hook calling ``callback(kind, name, value)``.
+
+    ``kind`` is one of ``'incr'``, ``'gauge'`` or ``'timing'``.
+    """
+
+    enabled = True
+
+    def __init__(self, callback, prefix=''):
+        self.callback = callback
+        self.prefix = prefix
+
+    def incr(self, name, value=1):
+        """Increment a counter."""
+        self.callback('incr', self.prefix + name, value)
+
+    def gauge(self, name, value):
+        """Set a gauge."""
+        self.callback('gauge', self.prefix + name, value)
+
+    def timing(self, name, seconds):
+        """Record a duration, in seconds."""
+        self.callback('timing', self.prefix + name, seconds)
+
+    def timer(self, name):
+        """Context manager recording the duration of its block."""
+        return Timer(self, name)
+
+
+class StatsdMetrics(CallbackMetrics):
+
+    """
+    Metrics hook sending to a statsd client.
+
+    Works with clients having ``incr``, ``gauge`` and ``timing`` methods,
+    timings are sent in milliseconds.
+    """
+
+    def __init__(self, client, prefix='obelix.'):
+        super(StatsdMetrics, self).__init__(self._send, prefix)
+        self.client = client
+
+    def _send(self, kind, name, value):
+        """Forward to the statsd client."""
+        if kind == 'timing':
+            self.client.timing(name, value * 1000)
+        else:
+            getattr(self.client, kind)(name, value)
+
+
+class Timer(object):
+
+    """Context manager recording the duration of its block."""
+
+    __slots__ = ('metrics', 'name', 'start', 'seconds')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+        self.seconds = None
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = clock() - self.start
+        self.metrics.timing(self.name, self.seconds)
+
+
+class _NullTimer(object):
+
+    """Timer doing nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
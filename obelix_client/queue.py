@@ -20,51 +20,102 @@
 
 """Obelix-Client Queue Proxy."""
 
+from .metrics import NullMetrics
+
 
 class RedisQueue(object):
 
-    """Redis Queue Proxy, takes care of de/encoding."""
+    """
+    Redis Queue Proxy, takes care of de/encoding.
+
+    The ``metrics`` hook gets the encoded size of the pushed values, per
+    queue.
+    """
 
-    def __init__(self, storage, prefix=None, encoder=None):
+    def __init__(self, storage, prefix=None, encoder=None, metrics=None):
         """Init RedisQueue."""
         self.prefix = prefix
         self.encoder = encoder
         self.storage = storage
+        self.metrics = metrics or NullMetrics()
 
-    def lpush(self, queue, value):
-        """Left Push to queue and encode value."""
-        if self.prefix:
-            queue = "{0}{1}".format(self.prefix, queue)
-        if self.encoder:
-            value = self.encoder.dumps(value)
+    def lpush(self, queue, *values):
+        """Left Push one or more values to queue and encode them."""
+        self.storage.lpush(self._queue(queue), *self._encode(values, queue))
 
-        self.storage.lpush(queue, value)
-
-    def rpush(self, queue, value):
-        """Right Push to queue and encode value."""
-        if self.prefix:
-            queue = "{0}{1}".format(self.prefix, queue)
-        if self.encoder:
-            value = self.encoder.dumps(value)
-
-        self.storage.rpush(queue, value)
+    def rpush(self, queue, *values):
+        """Right Push one or more values to queue and encode them."""
+        self.storage.rpush(self._queue(queue), *self._encode(values, queue))
 
     def rpop(self, queue):
         """Right Pop from queue and decode value."""
-        if self.prefix:
-            queue = "{0}{1}".format(self.prefix, queue)
-        data = self.storage.rpop(queue)
-        if self.encoder and data is not None:
-            data = self.encoder.loads(data)
-
-        return data
+        return self._decode(self.storage.rpop(self._queue(queue)))
 
     def lpop(self, queue):
         """Left Pop from queue and decode value."""
+        return self._decode(self.storage.lpop(self._queue(queue)))
+
+    def rpop_many(self, queue, count):
+        """
+        Right Pop up to ``count`` values from queue and decode them.
+
+        Needs a storage supporting ``rpop(name, count)`` (Redis >= 6.2),
+        all values come in one round trip.
+
+        :return: list of the values, in pop order, empty if none
+        """
+        datas = self.storage.rpop(self._queue(queue), count)
+        return [self._decode(data) for data in datas or ()]
+
+    def brpop_many(self, queue, count, timeout=0):
+        """
+        Right Pop up to ``count`` values, waiting for the first one.
+
+        Blocks up to ``timeout`` seconds (0 is forever) until a value is
+        available, then pops what else is there up to ``count``.
+
+        :return: list of the values, in pop order, empty on timeout
+        """
+        queue = self._queue(queue)
+        first = self.storage.brpop([queue], timeout)
+        if first is None:
+            return []
+
+        datas = [first[1]]
+        if count > 1:
+            datas.extend(self.storage.rpop(queue, count - 1) or ())
+        return [self._decode(data) for data in datas]
+
+    def iter_drain(self, queue, batch_size=1000):
+        """
+        Iterate over the values of queue until it is empty.
+
+        Values are popped from the right, ``batch_size`` per round trip.
+        """
+        while True:
+            values = self.rpop_many(queue, batch_size)
+            for value in values:
+                yield value
+            if len(values) < batch_size:
+                return
+
+    def _queue(self, queue):
+        """Add the prefix to a queue name."""
         if self.prefix:
             queue = "{0}{1}".format(self.prefix, queue)
-        data = self.storage.lpop(queue)
+        return queue
+
+    def _encode(self, values, queue=None):
+        """Encode the values to push."""
+        if self.encoder:
+            values = [self.encoder.dumps(value) for value in values]
+            if self.metrics.enabled:
+                self.metrics.incr('queue.{0}.bytes'.format(queue),
+                                  sum(len(value) for value in values))
+        return values
+
+    def _decode(self, data):
+        """Decode a popped value."""
         if self.encoder and data is not None:
             data = self.encoder.loads(data)
-
         return data
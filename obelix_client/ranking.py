@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Obelix-Client ranking strategies.
+
+A strategy scores a hitset, in ranking order, and selects its ``limit``
+best records. Every strategy gives the same records and scores, they
+differ by cost: each one estimates it from the sizes of the hitset and
+the recommendations, and the cheapest one able to rank a request is
+used. The ``ranking_strategy`` config forces one by name.
+
+Strategies are registered with :func:`register_strategy`.
+"""
+
+from . import utils
+from .hitset import SortedHitset
+from .metrics import NullMetrics
+
+_NULL_METRICS = NullMetrics()
+
+
+class RankingStrategy(object):
+
+    """Base of the ranking strategies."""
+
+    #: Name in the registry and in the ``ranking_strategy`` config
+    name = None
+
+    def cost(self, config, hitset, recommendations):
+        """
+        Estimate the cost of ranking a hitset, in records walked or looked
+        up.
+
+        :return: the cost, None if the strategy can not rank the hitset
+        """
+        raise NotImplementedError
+
+    def rank(self, config, hitset, recommendations, limit, scores_by_size,
+             timer):
+        """
+        Score a hitset and select the ``limit`` best records.
+
+        :param scores_by_size: dictionary {size: order scores} shared by
+            hitsets ranked together, see :func:`order_scores`
+        :param timer: timer factory of the metrics hook
+        :return: a tuple with two lists, the first is a list of records
+        and the second of scores
+        """
+        raise NotImplementedError
+
+
+class ProbeStrategy(RankingStrategy):
+
+    """Walk the hitset, looking every record up in the recommendations."""
+
+    name = 'probe'
+
+    def cost(self, config, hitset, recommendations):
+        """Every record is walked and looked up."""
+        return 2 * len(hitset)
+
+    def rank(self, config, hitset, recommendations, limit, scores_by_size,
+             timer):
+        """Score a hitset and select the ``limit`` best records."""
+        with timer('rank.order'):
+            records_by_order = utils.rank_records_by_order(
+                config, hitset, order_scores(config, len(hitset),
+                                             scores_by_size))
+
+        if recommendations is None:
+            final_scores = records_by_order
+        else:
+            # Calculate scores
+            with timer('rank.blend'):
+                final_scores = utils.calc_scores(config, records_by_order,
+                                                 recommendations)
+
+        # Only the records up to the requested page have to be ordered
+        with timer('rank.sort'):
+            return utils.top_records_by_score(final_scores, limit)
+
+
+class IntersectStrategy(RankingStrategy):
+
+    """
+    Walk the recommendations, looking them up in the hitset.
+
+    Used for hitsets above ``method_switch_limit`` records, when there
+    are fewer recommendations than records. Sorted hitsets are not even
+    walked to blend the scores.
+    """
+
+    name = 'intersect'
+
+    def cost(self, config, hitset, recommendations):
+        """Every record is walked and every recommendation looked up."""
+        if (recommendations is None or
+                len(hitset) <= config['method_switch_limit']):
+            return None
+        return len(hitset) + len(recommendations) * _lookup_cost(hitset)
+
+    def rank(self, config, hitset, recommendations, limit, scores_by_size,
+             timer):
+        """Score a hitset and select the ``limit`` best records."""
+        with timer('rank.order'):
+            scores = order_scores(config, len(hitset), scores_by_size)
+            if isinstance(hitset, SortedHitset):
+                records_by_order = None
+            else:
+                records_by_order = utils.rank_records_by_order(
+                    config, hitset, scores)
+
+        with timer('rank.blend'):
+            if records_by_order is None:
+                final_scores = utils.calc_scores_sorted(
+                    config, hitset, recommendations, scores)
+            else:
+                final_scores = utils.calc_scores_intersect(
+                    config, records_by_order, recommendations)
+
+        with timer('rank.sort'):
+            return utils.top_records_by_score(final_scores, limit)
+
+
+class MergeStrategy(RankingStrategy):
+
+    """
+    Merge the first records of the hitset with the recommended ones.
+
+    Only the records up to the limit are scored, so the cost does not
+    depend on the size of the hitset, see
+    :func:`~obelix_client.utils.top_records_sorted`. Needs a sorted
+    hitset and scores decreasing with the position, i.e. a
+    ``score_lower_limit`` and a ``recommendations_impact`` up to one.
+    """
+
+    name = 'merge'
+
+    def cost(self, config, hitset, recommendations):
+        """Records up to the limit are walked, recommendations looked up."""
+        if (not isinstance(hitset, SortedHitset) or
+                config['score_lower_limit'] > 1):
+            return None
+        elif recommendations is None:
+            return 0
+        elif config['recommendations_impact'] > 1:
+            return None
+        return len(recommendations) * _lookup_cost(hitset)
+
+    def rank(self, config, hitset, recommendations, limit, scores_by_size,
+             timer):
+        """Score a hitset and select the ``limit`` best records."""
+        with timer('rank.merge'):
+            return utils.top_records_sorted(config, hitset, recommendations,
+                                            limit)
+
+
+class NumpyStrategy(RankingStrategy):
+
+    """
+    Score with NumPy arrays.
+
+    Used when ``scoring_engine`` is ``'numpy'`` and NumPy is installed.
+    """
+
+    name = 'numpy'
+
+    def cost(self, config, hitset, recommendations):
+        """Preferred when configured."""
+        if config['scoring_engine'] != 'numpy' or utils.numpy is None:
+            return None
+        return 0
+
+    def rank(self, config, hitset, recommendations, limit, scores_by_size,
+             timer):
+        """Score a hitset and select the ``limit`` best records."""
+        with timer('rank.numpy'):
+            return utils.rank_records_array(config, hitset, recommendations,
+                                            limit)
+
+
+def _lookup_cost(hitset):
+    """Cost of looking a record up in a hitset, a binary search if sorted."""
+    if isinstance(hitset, SortedHitset):
+        return max(len(hitset).bit_length(), 1)
+    return 1
+
+
+_strategies = []
+
+
+def register_strategy(strategy):
+    """Register a strategy, replacing the one of the same name."""
+    unregister_strategy(strategy.name)
+    _strategies.append(strategy)
+
+
+def unregister_strategy(name):
+    """Remove a strategy from the registry."""
+    _strategies[:] = [strategy for strategy in _strategies
+                      if strategy.name != name]
+
+
+def get_strategy(name):
+    """Get a registered strategy by name."""
+    for strategy in _strategies:
+        if strategy.name == name:
+            return strategy
+    raise ValueError("Unknown ranking strategy: {0}".format(name))
+
+
+def choose_strategy(config, hitset, recommendations):
+    """
+    Choose the strategy to rank a hitset.
+
+    The strategy named by ``ranking_strategy`` if it can rank the hitset,
+    the cheapest one otherwise, the first registered on equal costs.
+    """
+    name = config.get('ranking_strategy')
+    if name:
+        strategy = get_strategy(name)
+        if strategy.cost(config, hitset, recommendations) is not None:
+            return strategy
+
+    best, best_cost = None, None
+    for strategy in _strategies:
+        cost = strategy.cost(config, hitset, recommendations)
+        if cost is not None and (best_cost is None or cost < best_cost):
+            best, best_cost = strategy, cost
+    return best
+
+
+def order_scores(config, size, scores_by_size=None):
+    """
+    Order scores of a hitset size, from the shared memo if possible.
+
+    :param scores_by_size: dictionary {size: order scores} for the sizes
+        too large for :func:`~obelix_client.utils.shared_order_scores`
+    :return: sequence of the scores, None if they are better generated
+        while walking the hitset
+    """
+    scores = utils.shared_order_scores(config, size)
+    if scores is None and scores_by_size is not None:
+        scores = scores_by_size.get(size)
+        if scores is None:
+            scores = utils.order_scores(config, size)
+            scores_by_size[size] = scores
+    return scores
+
+
+def rank_hitset(config, hitset, recommendations, limit,
+                scores_by_size=None, metrics=None):
+    """
+    Score a hitset and select the ``limit`` best records.
+
+    :param hitset: sequence of recids, already in ranking order, see
+        :func:`~obelix_client.hitset.as_hitset`
+    :param recommendations: dictionary or None
+    :param scores_by_size: dictionary {size: order scores} shared by
+        hitsets ranked together
+    :param metrics: hook timing the ranking stages
+    :return: a tuple with two lists, the first is a list of records
+    and the second of scores
+    """
+    metrics = metrics or _NULL_METRICS
+    strategy = choose_strategy(config, hitset, recommendations)
+    metrics.incr('rank.strategy.{0}'.format(strategy.name))
+    return strategy.rank(config, hitset, recommendations, limit,
+                         scores_by_size, metrics.timer)
+
+
+def rank_hitsets(config, jobs):
+    """
+    Rank several hitsets, sharing the order scores of equal sizes.
+
+    :param jobs: list of (hitset, recommendations, limit) tuples, the
+        arguments of :func:`rank_hitset`
+    :return: list of the (records, scores) tuples
+    """
+    scores_by_size = {}
+    return [rank_hitset(config, hitset, recommendations, limit,
+                        scores_by_size)
+            for hitset, recommendations, limit in jobs]
+
+
+def _rank_hitsets_job(args):
+    """Call :func:`rank_hitsets` in a pool worker."""
+    return rank_hitsets(*args)
+
+
+register_strategy(NumpyStrategy())
+register_strategy(ProbeStrategy())
+register_strategy(IntersectStrategy())
+register_strategy(MergeStrategy())
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Obelix-Client compact recommendations.
+
+Recommendations are stored as a small header followed by the recids,
+sorted, as little-endian int64 and their scores as little-endian
+float32. :class:`PackedRecommendations` reads that format in place and
+answers membership and score lookups with a binary search, so a user's
+recommendations never have to be decoded to a dictionary.
+"""
+
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+
+from .encoders import INT64_TYPECODE, array_bytes, int64_array, \
+    typed_view
+
+MAGIC = b'OBXR'
+
+_HEADER = struct.Struct('<4sI')
+
+_RECID_TYPECODE = INT64_TYPECODE
+
+_SCORE_TYPECODE = 'f'
+
+
+def pack_recommendations(recommendations):
+    """
+    Pack recommendations to the compact format.
+
+    :param recommendations: dictionary {recid: score} or anything with
+        ``items()``
+    :return: bytes
+    """
+    items = sorted((int(recid), score)
+                   for recid, score in recommendations.items())
+    recids = int64_array([recid for recid, _ in items])
+    scores = array(_SCORE_TYPECODE, [score for _, score in items])
+    if sys.byteorder != 'little':
+        recids.byteswap()
+        scores.byteswap()
+
+    return b''.join((_HEADER.pack(MAGIC, len(items)),
+                     array_bytes(recids), array_bytes(scores)))
+
+
+class PackedRecommendations(object):
+
+    """
+    Read-only recommendations in the compact format.
+
+    Behaves like the ``{recid: score}`` dictionary it was packed from for
+    lookups, i.e. it can be passed as ``recommendations`` to
+    :func:`~obelix_client.utils.calc_scores`. The scores are float32.
+    """
+
+    def __init__(self, data):
+        """Initialize from packed bytes, without copying them if possible."""
+        magic, size = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not packed recommendations")
+
+        self.data = data
+        start = _HEADER.size
+        middle = start + size * int64_array().itemsize
+        end = middle + size * array(_SCORE_TYPECODE).itemsize
+        self.recids = typed_view(data, start, middle, _RECID_TYPECODE)
+        self.scores = typed_view(data, middle, end, _SCORE_TYPECODE)
+        self._fingerprint = None
+
+    def __reduce__(self):
+        """Pickle the packed data, i.e. to send it to a process pool."""
+        data = self.data
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return PackedRecommendations, (data,)
+
+    def __len__(self):
+        """Number of recommended records."""
+        return len(self.recids)
+
+    def __iter__(self):
+        """Iterate over the recids, in ascending order."""
+        return iter(self.recids)
+
+    def __contains__(self, recid):
+        """Check if a record is recommended."""
+        return self._index(recid) is not None
+
+    def __getitem__(self, recid):
+        """Get the score of a record, KeyError if it is not recommended."""
+        index = self._index(recid)
+        if index is None:
+            raise KeyError(recid)
+        return self.scores[index]
+
+    def get(self, recid, default=None):
+        """Get the score of a record."""
+        index = self._index(recid)
+        if index is None:
+            return default
+        return self.scores[index]
+
+    def keys(self):
+        """List the recids, in ascending order."""
+        return list(self.recids)
+
+    def values(self):
+        """List the scores, in recid order."""
+        return list(self.scores)
+
+    def items(self):
+        """List the (recid, score) pairs, in recid order."""
+        return list(zip(self.recids, self.scores))
+
+    def to_dict(self):
+        """Decode to a ``{recid: score}`` dictionary."""
+        return dict(zip(self.recids, self.scores))
+
+    @property
+    def fingerprint(self):
+        """Fingerprint of the packed data."""
+        if self._fingerprint is None:
+            self._fingerprint = (len(self), zlib.crc32(self.data))
+        return self._fingerprint
+
+    def _index(self, recid):
+        """Position of a recid, None if it is not recommended."""
+        try:
+            index = bisect_left(self.recids, recid)
+        except TypeError:
+            return None
+        if index < len(self.recids) and self.recids[index] == recid:
+            return index
+        return None
+
+
+class PackedRecommendationsEncoder(object):
+
+    """Encoder for a recommendations storage, using the compact format."""
+
+    @staticmethod
+    def dumps(recommendations):
+        """Pack recommendations."""
+        return pack_recommendations(recommendations)
+
+    @staticmethod
+    def loads(data):
+        """Load packed recommendations, without decoding them."""
+        return PackedRecommendations(data)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Obelix-Client cache shared between processes.
+
+:class:`SharedMemoryStorage` keeps key, value pairs in a memory-mapped
+file, so every process of a host (i.e. pre-forked WSGI workers) mapping
+the same file shares the cached entries. It is a storage for
+:class:`~obelix_client.storage.StorageProxy`, values are the encoded
+bytes. Used with the ``PackedRecommendationsEncoder``, the
+recommendations a worker stored are used by the others without any
+decoding.
+
+The file is a fixed number of fixed size slots, grouped in sets of
+``ways`` slots. A key can only live in its set; when the set is full the
+least recently used entry of the set is evicted. Values not fitting in a
+slot are not cached. Each set is locked with ``lockf`` while it is read
+or written, so the storage needs ``fcntl``, i.e. a POSIX system.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+MAGIC = b'OBXS'
+
+#: magic, format version, number of slots, slot size, ways
+_FILE_HEADER = struct.Struct('<4sIIII')
+
+_FILE_HEADER_SIZE = 64
+
+#: used, key hash, expires (0 is never), last use, key size, value size
+_SLOT_HEADER = struct.Struct('<BQddII')
+
+_VERSION = 1
+
+
+class SharedMemoryStorage(object):
+
+    """
+    Storage in a memory-mapped file, shared by all processes mapping it.
+
+    Implements get/set like :class:`~obelix_client.storage.RedisMock`.
+    Values have to be bytes or text, which is stored UTF-8 encoded, so use
+    it with an encoder. Values are returned as bytes.
+    """
+
+    def __init__(self, path, slots=1024, slot_size=65536, ways=8,
+                 ttl=None):
+        """
+        Open or create the shared file.
+
+        :path: file to map, i.e. in ``/dev/shm``; every process has to
+            use the same ``slots``, ``slot_size`` and ``ways``
+        :slots: number of entries, rounded up to a multiple of ``ways``
+        :slot_size: bytes per entry, key and value included
+        :ways: slots per set, the eviction happens within a set
+        :ttl: default seconds entries stay valid, None to never expire
+        """
+        if fcntl is None:
+            raise ImportError("fcntl is needed to lock the shared file")
+        if slot_size <= _SLOT_HEADER.size:
+            raise ValueError("slot_size is too small")
+
+        self.path = path
+        self.ways = ways
+        self.sets = max(-(-slots // ways), 1)
+        self.slots = self.sets * ways
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        size = _FILE_HEADER_SIZE + self.slots * slot_size
+        header = _FILE_HEADER.pack(MAGIC, _VERSION, self.slots, slot_size,
+                                   ways)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self._lock_range(0, _FILE_HEADER_SIZE)
+            try:
+                if os.fstat(self.fd).st_size == 0:
+                    os.ftruncate(self.fd, size)
+                    os.write(self.fd, header)
+                elif self._read_header() != header:
+                    raise ValueError(
+                        "{0} is mapped with another layout".format(path))
+            finally:
+                self._unlock_range(0, _FILE_HEADER_SIZE)
+            self.map = mmap.mmap(self.fd, size)
+        except Exception:
+            os.close(self.fd)
+            raise
+
+    def _read_header(self):
+        """Read the file header, before the file is mapped."""
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        return os.read(self.fd, _FILE_HEADER.size)
+
+    def close(self):
+        """Unmap the file."""
+        self.map.close()
+        os.close(self.fd)
+
+    def get(self, key, default=None):
+        """Get a key."""
+        key = _key_bytes(key)
+        key_hash = _hash(key)
+        now = time.time()
+
+        with self._locked_set(key_hash % self.sets) as slots:
+            for offset in slots:
+                header = _SLOT_HEADER.unpack_from(self.map, offset)
+                if self._matches(header, offset, key_hash, key, now):
+                    used, _, expires, _, key_size, value_size = header
+                    start = offset + _SLOT_HEADER.size + key_size
+                    value = self.map[start:start + value_size]
+                    _SLOT_HEADER.pack_into(self.map, offset, used, key_hash,
+                                           expires, now, key_size,
+                                           value_size)
+                    self.hits += 1
+                    return value
+
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ex=None):
+        """
+        Set a key, value pair, expiring after ``ex`` seconds.
+
+        :return: False if the pair does not fit in a slot
+        """
+        if isinstance(value, type(u'')):
+            value = value.encode('utf-8')
+        elif not isinstance(value, bytes):
+            raise TypeError("Values have to be bytes, use an encoder")
+
+        key = _key_bytes(key)
+        if _SLOT_HEADER.size + len(key) + len(value) > self.slot_size:
+            self.delete(key)
+            return False
+
+        key_hash = _hash(key)
+        now = time.time()
+        ex = self.ttl if ex is None else ex
+        expires = now + ex if ex is not None else 0
+
+        with self._locked_set(key_hash % self.sets) as slots:
+            target = None
+            oldest = None
+            for offset in slots:
+                header = _SLOT_HEADER.unpack_from(self.map, offset)
+                if self._matches(header, offset, key_hash, key, None):
+                    target = offset
+                    break
+                used, _, slot_expires, last_use = header[:4]
+                if not used or (slot_expires and slot_expires <= now):
+                    last_use = -1
+                if oldest is None or last_use < oldest[0]:
+                    oldest = (last_use, offset)
+            if target is None:
+                target = oldest[1]
+
+            start = target + _SLOT_HEADER.size
+            self.map[start:start + len(key)] = key
+            self.map[start + len(key):start + len(key) + len(value)] = value
+            _SLOT_HEADER.pack_into(self.map, target, 1, key_hash, expires,
+                                   now, len(key), len(value))
+        return True
+
+    def delete(self, key):
+        """Delete a key, returns if it existed."""
+        key = _key_bytes(key)
+        key_hash = _hash(key)
+
+        with self._locked_set(key_hash % self.sets) as slots:
+            for offset in slots:
+                header = _SLOT_HEADER.unpack_from(self.map, offset)
+                if self._matches(header, offset, key_hash, key, None):
+                    _SLOT_HEADER.pack_into(self.map, offset,
+                                           *((0,) * len(header)))
+                    return True
+        return False
+
+    def clear(self):
+        """Remove all entries, for all processes."""
+        for set_index in range(self.sets):
+            with self._locked_set(set_index) as slots:
+                for offset in slots:
+                    _SLOT_HEADER.pack_into(self.map, offset, 0, 0, 0, 0, 0, 0)
+
+    def _matches(self, header, offset, key_hash, key, now):
+        """Check if a slot holds a key, still valid at ``now``."""
+        used, slot_hash, expires, _, key_size, _ = header
+        if not used or slot_hash != key_hash or key_size != len(key):
+            return False
+        if now is not None and expires and expires <= now:
+            return False
+        start = offset + _SLOT_HEADER.size
+        return self.map[start:start + key_size] == key
+
+    def _locked_set(self, set_index):
+        """Lock a set, yielding the offsets of its slots."""
+        start = _FILE_HEADER_SIZE + set_index * self.ways * self.slot_size
+        offsets = range(start, start + self.ways * self.slot_size,
+                        self.slot_size)
+        return _SetLock(self, start, self.ways * self.slot_size, offsets)
+
+    def _lock_range(self, start, length):
+        """Lock a byte range of the file for this process."""
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, length, start)
+
+    def _unlock_range(self, start, length):
+        """Unlock a byte range of the file."""
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, length, start)
+
+
+class _SetLock(object):
+
+    """Lock of a set, for the threads and the processes."""
+
+    def __init__(self, storage, start, length, offsets):
+        self.storage = storage
+        self.start = start
+        self.length = length
+        self.offsets = offsets
+
+    def __enter__(self):
+        self.storage.lock.acquire()
+        try:
+            self.storage._lock_range(self.start, self.length)
+        except Exception:
+            self.storage.lock.release()
+            raise
+        return self.offsets
+
+    def __exit__(self, *exc_info):
+        try:
+            self.storage._unlock_range(self.start, self.length)
+        finally:
+            self.storage.lock.release()
+
+
+def _key_bytes(key):
+    """Key as bytes."""
+    if isinstance(key, bytes):
+        return key
+    return str(key).encode('utf-8')
+
+
+def _hash(key):
+    """Hash of a key, the same in every process."""
+    return struct.unpack('<Q', hashlib.md5(key).digest()[:8])[0]
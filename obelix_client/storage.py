@@ -20,6 +20,17 @@
 
 """Obelix-Client Storage Proxy."""
 
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+from .cache import LRUCache
+
+_MISSING = object()
+
+_NEGATIVE = object()
+
 
 class StorageProxy(object):
 
@@ -41,35 +52,95 @@ class StorageProxy(object):
 
     def get(self, key, default=None):
         """Get a key."""
-        if self.prefix:
-            key = "{0}{1}".format(self.prefix, key)
+        key = self._key(key)
 
         try:
             data = self.storage.get(key)
-            # Redis returns None not a exception
-            if data is None:
-                data = default
         except KeyError:
-            data = default
+            data = None
 
-            # encode only if default is not set
-        if self.encoder and data and data is not default:
-            data = self.encoder.loads(data)
+        return self._decode(data, default)
 
-        return data
+    def set(self, key, value, ttl=None):
+        """
+        Set a key, value pair.
 
-    def set(self, key, value):
-        """Set a key, value pair."""
+        :ttl: seconds until the key expires, passed as ``ex`` to the
+            storage's ``set`` (as Redis takes it), ignored by dictionaries
+        """
+        key = self._key(key)
+        value = self._encode(value)
+
+        if hasattr(self.storage, 'set'):
+            if ttl is None:
+                self.storage.set(key, value)
+            else:
+                self.storage.set(key, value, ex=ttl)
+        else:
+            self.storage[key] = value
+
+    def get_many(self, keys, default=None):
+        """
+        Get several keys at once.
+
+        Uses a single ``mget`` if the storage supports it.
+
+        :return: list of the values, in the order of ``keys``
+        """
+        keys = [self._key(key) for key in keys]
+
+        if hasattr(self.storage, 'mget'):
+            datas = self.storage.mget(keys)
+        else:
+            datas = []
+            for key in keys:
+                try:
+                    datas.append(self.storage.get(key))
+                except KeyError:
+                    datas.append(None)
+
+        return [self._decode(data, default) for data in datas]
+
+    def set_many(self, mapping):
+        """
+        Set several key, value pairs at once.
+
+        Uses a single ``mset`` if the storage supports it.
+        """
+        mapping = dict((self._key(key), self._encode(value))
+                       for key, value in mapping.items())
+
+        if hasattr(self.storage, 'mset'):
+            self.storage.mset(mapping)
+        elif hasattr(self.storage, 'set'):
+            for key, value in mapping.items():
+                self.storage.set(key, value)
+        else:
+            self.storage.update(mapping)
+
+    def _key(self, key):
+        """Add the prefix to a key."""
         if self.prefix:
             key = "{0}{1}".format(self.prefix, key)
+        return key
 
+    def _encode(self, value):
+        """Encode a value to store it."""
         if self.encoder:
             value = self.encoder.dumps(value)
+        return value
 
-        if hasattr(self.storage, 'set'):
-            self.storage.set(key, value)
-        else:
-            self.storage[key] = value
+    def _decode(self, data, default):
+        """Decode a stored value, falling back to default when missing."""
+        # Redis returns None not a exception
+        if data is None:
+            data = default
+
+        # decode only if default is not set
+        if self.encoder and data and data is not default:
+            data = self.encoder.loads(data)
+
+        return data
 
 
 class RedisStorage(StorageProxy):
@@ -88,9 +159,136 @@ class RedisStorage(StorageProxy):
         """Get a key."""
         return super(RedisStorage, self).get(key, default)
 
-    def set(self, key, value):
+    def set(self, key, value, ttl=None):
         """Set a key, value pair."""
-        super(RedisStorage, self).set(key, value)
+        super(RedisStorage, self).set(key, value, ttl)
+
+    def get_many(self, keys, default=None):
+        """Get several keys with one MGET."""
+        return super(RedisStorage, self).get_many(keys, default)
+
+    def set_many(self, mapping):
+        """Set several key, value pairs with one MSET."""
+        super(RedisStorage, self).set_many(mapping)
+
+
+class CachedStorage(object):
+
+    """
+    In-process cache in front of a storage.
+
+    Wraps any storage with the StorageProxy get/set contract, i.e. a
+    :class:`RedisStorage` passed to Obelix, keeping the decoded values in
+    a size bounded LRU cache. Writes go through to the storage.
+
+    Keys missing from the storage are cached too, for ``negative_ttl``
+    seconds, as most users have no recommendations. Cached values are
+    shared, do not modify them.
+    """
+
+    def __init__(self, storage, maxsize=1024, ttl=60, negative_ttl=None,
+                 ttls=None, timer=time.time):
+        """
+        Initialize the cache.
+
+        :maxsize: maximum number of cached keys
+        :ttl: default seconds a value stays cached, None to never expire
+        :negative_ttl: seconds a miss stays cached, ``ttl`` by default,
+            0 to not cache misses
+        :ttls: dictionary {key: ttl} of per-key TTLs, i.e. for "settings"
+        """
+        self.storage = storage
+        self.cache = LRUCache(maxsize, ttl, timer)
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.ttls = ttls or {}
+        self.negative_hits = 0
+
+    @property
+    def hits(self):
+        """Lookups answered from the cache, misses included."""
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        """Lookups that went to the storage."""
+        return self.cache.misses
+
+    @property
+    def hit_ratio(self):
+        """Ratio of lookups answered from the cache."""
+        return self.cache.hit_ratio
+
+    def get(self, key, default=None):
+        """Get a key."""
+        value = self.cache.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.storage.get(key)
+            self._cache(key, value)
+
+        if value is _NEGATIVE or value is None:
+            if value is _NEGATIVE:
+                self.negative_hits += 1
+            return default
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Set a key, value pair, in the storage and the cache."""
+        if ttl is None:
+            self.storage.set(key, value)
+        else:
+            self.storage.set(key, value, ttl)
+        self._cache(key, value, ttl)
+
+    def get_many(self, keys, default=None):
+        """Get several keys, fetching the ones not cached at once."""
+        values = [self.cache.get(key, _MISSING) for key in keys]
+        missing = [key for key, value in zip(keys, values)
+                   if value is _MISSING]
+
+        if missing:
+            if hasattr(self.storage, 'get_many'):
+                fetched = self.storage.get_many(missing)
+            else:
+                fetched = [self.storage.get(key) for key in missing]
+            fetched = dict(zip(missing, fetched))
+            for key, value in fetched.items():
+                self._cache(key, value)
+            values = [fetched[key] if value is _MISSING else value
+                      for key, value in zip(keys, values)]
+
+        return [default if value is None or value is _NEGATIVE else value
+                for value in values]
+
+    def set_many(self, mapping):
+        """Set several key, value pairs, in the storage and the cache."""
+        if hasattr(self.storage, 'set_many'):
+            self.storage.set_many(mapping)
+        else:
+            for key, value in mapping.items():
+                self.storage.set(key, value)
+        for key, value in mapping.items():
+            self._cache(key, value)
+
+    def invalidate(self, key=None):
+        """Drop a key, or everything, from the cache only."""
+        if key is None:
+            self.cache.clear()
+        else:
+            self.cache.delete(key)
+
+    def _cache(self, key, value, ttl=None):
+        """Cache a value, or a miss if it is None."""
+        if value is None:
+            if self.negative_ttl:
+                self.cache.set(key, _NEGATIVE, self.negative_ttl)
+            else:
+                self.cache.delete(key)
+            return
+
+        ttl = self.ttls.get(key, ttl)
+        if ttl is not None and self.cache.ttl is not None:
+            ttl = min(ttl, self.cache.ttl)
+        self.cache.set(key, value, ttl)
 
 
 class RedisMock(object):
@@ -98,53 +296,219 @@ class RedisMock(object):
     """
     Redis Mock.
 
-    Implements Redis based on dictionary's
+    Implements Redis based on dictionary's, queues are deques. All
+    operations are thread safe, so it can stand in for Redis in load
+    tests and benchmarks.
     """
 
     def __init__(self):
         """Initialize storage dicts."""
         self.storage = {}
         self.queues = {}
+        self.expires = {}
+        self.lock = threading.RLock()
+        self.condition = threading.Condition(self.lock)
 
     def get(self, key, default=None):
         """Get a key."""
-        return self.storage.get(key, default)
+        with self.lock:
+            self._check_expired(key)
+            return self.storage.get(key, default)
 
-    def set(self, key, value):
-        """Set a key, value pair."""
-        self.storage[key] = value
+    def set(self, key, value, ex=None):
+        """Set a key, value pair, expiring after ``ex`` seconds."""
+        with self.lock:
+            self.storage[key] = value
+            self.expires.pop(key, None)
+            if ex is not None:
+                self.expires[key] = time.time() + ex
+
+    def mget(self, keys):
+        """Get several keys, None for the missing ones."""
+        with self.lock:
+            # Not self.get, the asyncio mock overrides it with a coroutine
+            return [RedisMock.get(self, key) for key in keys]
+
+    def mset(self, mapping):
+        """Set several key, value pairs."""
+        with self.lock:
+            for key, value in mapping.items():
+                RedisMock.set(self, key, value)
+
+    def delete(self, *keys):
+        """Delete keys and queues, returns how many existed."""
+        with self.lock:
+            deleted = 0
+            for key in keys:
+                self._check_expired(key)
+                self.expires.pop(key, None)
+                if (self.storage.pop(key, _MISSING) is not _MISSING or
+                        self.queues.pop(key, None) is not None):
+                    deleted += 1
+            return deleted
+
+    def expire(self, key, seconds):
+        """Expire a key or queue after some seconds."""
+        with self.lock:
+            self._check_expired(key)
+            if key not in self.storage and key not in self.queues:
+                return False
+            self.expires[key] = time.time() + seconds
+            return True
+
+    def lpush(self, queue, *values):
+        """Left Push one or more values to queue."""
+        with self.lock:
+            items = self._queue(queue)
+            items.extendleft(values)
+            self.condition.notify_all()
+            return len(items)
+
+    def rpush(self, queue, *values):
+        """Right Push one or more values to queue."""
+        with self.lock:
+            items = self._queue(queue)
+            items.extend(values)
+            self.condition.notify_all()
+            return len(items)
+
+    def rpop(self, queue, count=None):
+        """
+        Right Pop from queue (Item gets removed).
 
-    def lpush(self, queue, value):
-        """Left Push to queue."""
-        if not self.queues.get(queue):
-            # Create queue
-            self.queues[queue] = []
-        self.queues[queue].insert(0, value)
+        With ``count``, pops up to count items and returns them as a list,
+        or None if the queue is empty.
+        """
+        return self._pop(queue, count, deque.pop)
 
-    def rpush(self, queue, value):
-        """Right Push to queue."""
-        if not self.queues.get(queue):
-            # Create queue
-            self.queues[queue] = []
-        self.queues[queue].append(value)
+    def lpop(self, queue, count=None):
+        """
+        Left Pop from queue (Item gets removed).
 
-    def rpop(self, queue):
-        """Right Pop from queue (Item gets removed)."""
-        try:
-            data = self.queues[queue].pop()
-        except KeyError:
-            data = None
+        With ``count``, pops up to count items and returns them as a list,
+        or None if the queue is empty.
+        """
+        return self._pop(queue, count, deque.popleft)
 
-        return data
+    def brpop(self, keys, timeout=0):
+        """
+        Right Pop from the first non empty queue.
 
-    def lpop(self, queue):
-        """Left Pop from queue (Item gets removed)."""
-        try:
-            data = self.queues[queue].pop(0)
-        except KeyError:
-            data = None
+        Waits up to ``timeout`` seconds (0 is forever) for an item.
 
-        return data
+        :return: tuple (queue, item) or None on timeout
+        """
+        if not isinstance(keys, (list, tuple)):
+            keys = [keys]
+        deadline = time.time() + timeout if timeout else None
+
+        with self.condition:
+            while True:
+                for queue in keys:
+                    if self.llen(queue):
+                        return queue, self.queues[queue].pop()
+
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self.condition.wait(remaining)
+
+    def llen(self, queue):
+        """Length of a queue."""
+        with self.lock:
+            self._check_expired(queue)
+            return len(self.queues.get(queue, ()))
+
+    def lrange(self, queue, start, end):
+        """Items of a queue from start to end, both included."""
+        with self.lock:
+            size = self.llen(queue)
+            if start < 0:
+                start += size
+            if end < 0:
+                end += size
+            start = max(start, 0)
+            end = min(end, size - 1)
+            if start > end:
+                return []
+            return list(islice(self.queues[queue], start, end + 1))
+
+    def pipeline(self, transaction=True):
+        """Pipeline, running the buffered commands atomically."""
+        return RedisMockPipeline(self)
+
+    def _queue(self, queue):
+        """Get a queue, creating it if needed."""
+        self._check_expired(queue)
+        items = self.queues.get(queue)
+        if items is None:
+            # Create queue
+            items = self.queues[queue] = deque()
+        return items
+
+    def _pop(self, queue, count, pop):
+        """Pop one item, or up to count as a list (None if empty)."""
+        with self.lock:
+            self._check_expired(queue)
+            items = self.queues.get(queue)
+            if count is None:
+                try:
+                    return pop(items)
+                except (TypeError, IndexError):
+                    return None
+
+            if not items:
+                return None
+            return [pop(items) for _ in range(min(count, len(items)))]
+
+    def _check_expired(self, key):
+        """Remove a key or queue if it expired."""
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.time():
+            del self.expires[key]
+            self.storage.pop(key, None)
+            self.queues.pop(key, None)
+
+
+class RedisMockPipeline(object):
+
+    """
+    Pipeline of a RedisMock.
+
+    Commands are buffered and run under the mock's lock on execute.
+    """
+
+    def __init__(self, redis):
+        """Initialize the pipeline."""
+        self.redis = redis
+        self.commands = []
+
+    def __enter__(self):
+        """Use as a context manager, like redis-py."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Drop the commands not executed."""
+        self.commands = []
+
+    def __getattr__(self, name):
+        """Buffer a command of the mock."""
+        method = getattr(self.redis, name)
+
+        def command(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+        return command
+
+    def execute(self):
+        """Run the buffered commands, returns their results."""
+        commands, self.commands = self.commands, []
+        with self.redis.lock:
+            return [method(*args, **kwargs)
+                    for method, args, kwargs in commands]
 
 
 # class RESTStorage(object):
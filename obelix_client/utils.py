@@ -19,8 +19,112 @@
 
 """Obelix-Client utils."""
 
+import atexit
+import hashlib
+import heapq
+import json
+import logging
+import numbers
+import threading
+import time
+import weakref
+import zlib
+from collections import deque
+from itertools import islice
 
-def rank_records_by_order(conf, hitset):
+from .cache import LRUCache
+from .hitset import ReversedHitset, SortedHitset, as_hitset, \
+    reversed_hitset
+from .metrics import NullMetrics, clock
+from .recommendations import PackedRecommendations
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+def iter_order_scores(conf, size):
+    """
+    Iterate over the scores by position of a hitset of ``size`` records.
+
+    See :func:`order_scores`, without building the list.
+    """
+    if size == 1:
+        yield conf['score_one_result']
+        return
+    elif not size:
+        return
+
+    lower, step = order_score_step(conf, size)
+    for i in range(0, size):
+        yield 1 - (lower + i * step)
+
+
+def order_score_step(conf, size):
+    """
+    Get the score of the first record and the decrease per position.
+
+    The record at position ``i`` of a hitset of ``size`` records, above
+    one, scores ``1 - (lower + i * step)``.
+
+    :return: a tuple (lower, step)
+    """
+    upper = 1
+    lower = conf['score_lower_limit']
+    scaled_size = size
+
+    if scaled_size < conf['score_min_limit']:
+        scaled_size *= conf['score_min_multiply']
+
+    return lower, ((upper - lower) * 1.0 / scaled_size)
+
+
+def order_scores(conf, size):
+    """
+    Scores of the records of a hitset of ``size`` records by position.
+
+    They only depend on the size and the config, hitsets of the same
+    size can share them.
+
+    :return: list of ``size`` scores, the first one is the best
+    """
+    return list(iter_order_scores(conf, size))
+
+
+#: Largest hitset size whose order scores are memoized
+ORDER_SCORES_MEMO_MAX_SIZE = 10000
+
+#: Number of scores the memo keeps, in all the hitset sizes
+ORDER_SCORES_MEMO_BUDGET = 200000
+
+#: Order scores of the recent hitset sizes, shared by all the clients
+order_scores_memo = LRUCache(maxsize=ORDER_SCORES_MEMO_BUDGET, sizeof=len)
+
+
+def shared_order_scores(conf, size):
+    """
+    Order scores of a hitset size, memoized for all the clients.
+
+    The memo is keyed by the size and the config the scores depend on,
+    its efficiency is ``order_scores_memo.hit_ratio``.
+
+    :return: tuple of the scores, see :func:`order_scores`, None if
+        ``size`` is above :data:`ORDER_SCORES_MEMO_MAX_SIZE`
+    """
+    if size > ORDER_SCORES_MEMO_MAX_SIZE:
+        return None
+
+    key = (size, conf['score_lower_limit'], conf['score_min_limit'],
+           conf['score_min_multiply'], conf['score_one_result'])
+    scores = order_scores_memo.get(key)
+    if scores is None:
+        scores = tuple(iter_order_scores(conf, size))
+        order_scores_memo.set(key, scores)
+    return scores
+
+
+def rank_records_by_order(conf, hitset, scores=None):
     """
     Rank the records by the original order they we're provided.
 
@@ -30,32 +134,22 @@ def rank_records_by_order(conf, hitset):
     Typically called like this:
         records, scores = __build_ranked_by_order()
 
+    :param scores: scores by position computed beforehand, see
+        :func:`order_scores`
     :return:
         A tuple, one list with records and one with scores.
         The list of records are integers while the scores
         are floats: [1,2,3],[.9,.8,7] etc...
     """
-    if len(hitset) == 1:
-        return {hitset[0]: conf['score_one_result']}
-    elif not hitset:
+    if not hitset:
         return {}
 
-    upper = 1
-    lower = conf['score_lower_limit']
-    size = len(hitset)
-
-    if size < conf['score_min_limit']:
-        size *= conf['score_min_multiply']
-
-    step = ((upper - lower) * 1.0 / size)
-    scores = [1 - (lower + i * step) for i in range(0, size)]
-    scores = scores[0:len(hitset)]
-
-    ranked_hitset = {}
-    for idx, score in enumerate(scores):
-        ranked_hitset[hitset[idx]] = score
+    if scores is None:
+        scores = shared_order_scores(conf, len(hitset))
+    if scores is None:
+        scores = iter_order_scores(conf, len(hitset))
 
-    return ranked_hitset
+    return dict(zip(hitset, scores))
 
 
 def sort_records_by_score(rec_scores):
@@ -76,12 +170,39 @@ def sort_records_by_score(rec_scores):
     return records, scores
 
 
+def top_records_by_score(rec_scores, limit):
+    """
+    Select the ``limit`` best records by score.
+
+    Equivalent to ``sort_records_by_score(rec_scores)`` truncated to
+    ``limit`` items, including the order of records with equal scores,
+    but only the selected records are materialized.
+
+    :param record_scores: dictionary {1:0.2, 2:0.3 etc...
+    :param limit: number of records to select
+    :return: a tuple with two lists, the first is a list of records
+    and the second of scores
+    """
+    records = []
+    scores = []
+
+    if limit <= 0:
+        return records, scores
+
+    for recid in heapq.nlargest(limit, rec_scores, key=rec_scores.get):
+        records.append(recid)
+        scores.append(rec_scores[recid])
+
+    return records, scores
+
+
 def calc_scores(config, records_by_order, recommendations):
     """
     Calculate the scores based on the records and the recommendations.
 
     :param records_by_order: dictionary {1:0,2. recid: score,}
-    :param recommendations: dictionary
+    :param recommendations: dictionary or
+        :class:`~obelix_client.recommendations.PackedRecommendations`
     """
     final_scores = {}
 
@@ -95,21 +216,703 @@ def calc_scores(config, records_by_order, recommendations):
     return final_scores
 
 
+def calc_scores_intersect(config, records_by_order, recommendations):
+    """
+    Calculate the scores, looking up the recommended records only.
+
+    Same scores as :func:`calc_scores`, the recommendations are walked
+    instead of the records, cheaper when they are fewer.
+
+    :param records_by_order: dictionary {1:0,2. recid: score,}
+    :param recommendations: dictionary or
+        :class:`~obelix_client.recommendations.PackedRecommendations`
+    """
+    impact = config['recommendations_impact']
+    final_scores = dict((recid, rec_score * (1 - impact))
+                        for recid, rec_score in records_by_order.items())
+
+    for recid in recommendations:
+        rec_score = records_by_order.get(recid)
+        if rec_score is not None:
+            final_scores[recid] = (rec_score * (1 - impact) +
+                                   recommendations[recid] * impact)
+
+    return final_scores
+
+
+def calc_scores_sorted(config, hitset, recommendations, scores=None):
+    """
+    Calculate the scores of a sorted hitset.
+
+    Same scores as :func:`calc_scores` of the records ranked by
+    :func:`rank_records_by_order`, but only the recommended records of
+    the hitset are looked up, by their position in it.
+
+    :param hitset: :class:`~obelix_client.hitset.SortedHitset`
+    :param recommendations: dictionary or
+        :class:`~obelix_client.recommendations.PackedRecommendations`
+    :param scores: scores by position computed beforehand, see
+        :func:`order_scores`
+    """
+    if scores is None:
+        scores = shared_order_scores(config, len(hitset))
+    if scores is None:
+        scores = order_scores(config, len(hitset))
+
+    impact = config['recommendations_impact']
+    final_scores = dict(zip(hitset,
+                            [score * (1 - impact) for score in scores]))
+    for position, recid in hitset.intersection(recommendations):
+        final_scores[recid] = (scores[position] * (1 - impact) +
+                               recommendations[recid] * impact)
+
+    return final_scores
+
+
+def top_records_sorted(config, hitset, recommendations, limit):
+    """
+    Select the ``limit`` best records of a sorted hitset.
+
+    Same records and scores as :func:`top_records_by_score` of the scores
+    :func:`calc_scores_sorted` calculates, without scoring the whole
+    hitset. As long as the scores decrease with the position, the records
+    that are not recommended keep the order of the hitset: the first ones
+    are merged with the recommended records of the hitset, and only the
+    records up to ``limit`` are scored.
+
+    :param hitset: :class:`~obelix_client.hitset.SortedHitset`
+    :param recommendations: dictionary,
+        :class:`~obelix_client.recommendations.PackedRecommendations` or
+        None
+    :return: a tuple with two lists, the first is a list of records
+    and the second of scores
+    """
+    size = len(hitset)
+    if limit <= 0 or not size:
+        return [], []
+    elif size == 1:
+        scores = {hitset[0]: config['score_one_result']}
+        if recommendations is not None:
+            scores = calc_scores_sorted(config, hitset, recommendations,
+                                        list(scores.values()))
+        return top_records_by_score(scores, limit)
+
+    lower, step = order_score_step(config, size)
+    impact = config['recommendations_impact']
+    factor = 1 if recommendations is None else 1 - impact
+
+    # Recommended records, best first, ties by position
+    recommended = []
+    if recommendations is not None:
+        for position, recid in hitset.intersection(recommendations):
+            score = ((1 - (lower + position * step)) * (1 - impact) +
+                     recommendations[recid] * impact)
+            recommended.append((-score, position, recid))
+        recommended.sort()
+    skipped = set(position for _, position, _ in recommended)
+
+    def not_recommended():
+        """Records that are not recommended, in order."""
+        position = 0
+        while position < size:
+            if position not in skipped:
+                score = (1 - (lower + position * step)) * factor
+                yield -score, position, hitset[position]
+            position += 1
+
+    records = []
+    scores = []
+    for score, _, recid in islice(heapq.merge(recommended,
+                                              not_recommended()), limit):
+        records.append(recid)
+        scores.append(-score)
+
+    return records, scores
+
+
+def rank_records_by_order_array(conf, hitset):
+    """
+    Rank the records by the original order, array based.
+
+    Same scores as :func:`rank_records_by_order`, computed with NumPy.
+    Duplicated recids are resolved like the dictionary version does: a
+    record keeps the position of its first occurrence and the score of
+    its last one.
+
+    :param hitset: sequence of recids, already in ranking order
+    :return: a tuple of two arrays, the recids and their scores
+    """
+    if isinstance(hitset, ReversedHitset):
+        # Without a copy for arrays
+        recids = numpy.asarray(hitset.hitset, dtype=numpy.int64)[::-1]
+    else:
+        recids = numpy.asarray(hitset, dtype=numpy.int64)
+    if recids.ndim != 1:
+        recids = numpy.fromiter(hitset, dtype=numpy.int64)
+
+    size = len(recids)
+    if size == 1:
+        return recids, numpy.array([conf['score_one_result']],
+                                   dtype=numpy.float64)
+    elif not size:
+        return recids, numpy.empty(0, dtype=numpy.float64)
+
+    lower = conf['score_lower_limit']
+    if size < conf['score_min_limit']:
+        size *= conf['score_min_multiply']
+
+    step = ((1 - lower) * 1.0 / size)
+    scores = 1 - (lower + numpy.arange(len(recids)) * step)
+
+    unique, first = numpy.unique(recids, return_index=True)
+    if len(unique) != len(recids):
+        last = len(recids) - 1 - numpy.unique(recids[::-1],
+                                              return_index=True)[1]
+        keep = numpy.argsort(first)
+        recids = recids[first[keep]]
+        scores = scores[last[keep]]
+
+    return recids, scores
+
+
+def calc_scores_array(config, recids, scores, recommendations):
+    """
+    Calculate the scores based on the recommendations, array based.
+
+    Same scores as :func:`calc_scores`, the recommendations are joined
+    to the records with a sorted array lookup.
+
+    :param recids: array of recids
+    :param scores: array of the order based scores of ``recids``
+    :param recommendations: dictionary or
+        :class:`~obelix_client.recommendations.PackedRecommendations`
+    """
+    impact = config['recommendations_impact']
+    reco_scores = numpy.zeros(len(recids), dtype=numpy.float64)
+
+    if recommendations and len(recids):
+        if isinstance(recommendations, PackedRecommendations):
+            # Already sorted arrays
+            reco_ids = numpy.asarray(recommendations.recids)
+            reco_values = numpy.asarray(recommendations.scores,
+                                        dtype=numpy.float64)
+        else:
+            # Only the keys a recid can match, i.e. not the strings of
+            # recommendations decoded from JSON
+            keys = [recid for recid in recommendations
+                    if _is_recid_key(recid)]
+            reco_ids = numpy.fromiter(keys, dtype=numpy.int64,
+                                      count=len(keys))
+            reco_values = numpy.fromiter(
+                (recommendations[recid] for recid in keys),
+                dtype=numpy.float64, count=len(keys))
+            order = numpy.argsort(reco_ids)
+            reco_ids = reco_ids[order]
+            reco_values = reco_values[order]
+
+        if len(reco_ids):
+            positions = numpy.searchsorted(reco_ids, recids)
+            positions[positions == len(reco_ids)] = 0
+            found = reco_ids[positions] == recids
+            reco_scores[found] = reco_values[positions[found]]
+
+    return scores * (1 - impact) + reco_scores * impact
+
+
+def _is_recid_key(key):
+    """Check if a recommendations key can be equal to an integer recid."""
+    if isinstance(key, float):
+        return key.is_integer()
+    return isinstance(key, numbers.Integral)
+
+
+def top_records_array(recids, scores, limit):
+    """
+    Select the ``limit`` best records by score, array based.
+
+    Ties are ordered like :func:`top_records_by_score` orders them, by
+    their position in ``recids``.
+
+    :return: a tuple with two lists, the first is a list of records
+    and the second of scores
+    """
+    if limit <= 0 or not len(recids):
+        return [], []
+
+    if limit < len(scores):
+        # Every record scoring at least the limit-th best score is a
+        # candidate, ties included, in their original order
+        threshold = numpy.partition(scores, len(scores) - limit)[
+            len(scores) - limit]
+        candidates = numpy.flatnonzero(scores >= threshold)
+    else:
+        candidates = numpy.arange(len(scores))
+
+    order = numpy.argsort(-scores[candidates], kind='stable')[:limit]
+    selected = candidates[order]
+
+    return recids[selected].tolist(), scores[selected].tolist()
+
+
+def rank_records_array(config, hitset, recommendations, limit):
+    """
+    Rank the records with the NumPy scoring engine.
+
+    :param hitset: sequence of recids, already in ranking order
+    :param recommendations: dictionary or None
+    :param limit: number of records to return
+    :return: a tuple with two lists, the first is a list of records
+    and the second of scores
+    """
+    recids, scores = rank_records_by_order_array(config, hitset)
+    if recommendations is not None:
+        scores = calc_scores_array(config, recids, scores, recommendations)
+
+    return top_records_array(recids, scores, limit)
+
+
+def trim_record_ids(record_ids, start, size):
+    """
+    Keep only a window of the results of every collection.
+
+    :param record_ids: list with the list of records of every collection
+    :param start: position of the first record kept
+    :param size: number of records kept per collection
+    :return: a tuple with the windows, their offsets and the number of
+        records of every collection
+    """
+    windows = [list(collection_result[start:start + size])
+               for collection_result in record_ids]
+    offsets = [min(start, len(collection_result))
+               for collection_result in record_ids]
+    counts = [len(collection_result) for collection_result in record_ids]
+    return windows, offsets, counts
+
+
+def build_hit_index(record_ids, start=0, size=None):
+    """
+    Index the hits of the shown records in the results of a search.
+
+    The hit numbers are the ones :func:`find_hits` finds scanning all
+    the results, without scanning them on every page view. A record only
+    has the hits of the collections it is shown in, i.e. where it is in
+    the window of ``size`` records from ``start``.
+
+    :param record_ids: list with the list of records of every collection
+    :param start: position of the first shown record of every collection
+    :param size: number of shown records per collection, None for all
+    :return: dictionary {str(recid): [[collection, local, global], ...]},
+        keys are strings so that the index survives any encoder
+    """
+    end = None if size is None else start + size
+    shown = set()
+    for collection_result in record_ids:
+        shown.update(collection_result[start:end])
+
+    index = {}
+    previous_hits = {}
+    offset = 0
+    for collection, collection_result in enumerate(record_ids):
+        first_hits = {}
+        for local, recid in enumerate(collection_result):
+            if recid in shown and recid not in first_hits:
+                first_hits[recid] = local
+
+        window = set(collection_result[start:end])
+        for recid, local in first_hits.items():
+            previous_hits[recid] = previous_hits.get(recid, 0) + local
+            if recid in window:
+                index.setdefault(str(recid), []).append(
+                    [collection, local, offset + previous_hits[recid]])
+
+        offset += len(collection_result)
+
+    for hits in index.values():
+        hits.sort()
+    return index
+
+
+def find_hits(record_ids, recid, offsets=None, counts=None):
+    """
+    Find the hits of a record by scanning the results of a search.
+
+    :param record_ids: list with the list of records of every collection,
+        or windows of them as made by :func:`trim_record_ids`
+    :param offsets: position of every window in its collection
+    :param counts: number of records of every collection
+    :return: list of [collection, local, global] hit numbers
+    """
+    hits = []
+    hit_number_global = 0
+    for collection, collection_result in enumerate(record_ids):
+        if recid in collection_result:
+            hit_number_local = collection_result.index(recid)
+            if offsets:
+                hit_number_local += offsets[collection]
+            hit_number_global += hit_number_local
+            hits.append([collection, hit_number_local, hit_number_global])
+
+        if counts:
+            hit_number_global += counts[collection]
+        else:
+            hit_number_global += len(collection_result)
+    return hits
+
+
+def hitset_fingerprint(hitset):
+    """
+    Fingerprint of a hitset, used as part of cache keys.
+
+    The hitset is hashed by chunks, so that it is not copied, the buffers
+    of sorted hitsets at once.
+    """
+    if isinstance(hitset, SortedHitset):
+        fingerprint = hitset.fingerprint
+        if fingerprint is not None:
+            return fingerprint
+
+    fingerprint = len(hitset)
+    records = iter(hitset)
+    chunk = tuple(islice(records, 4096))
+    while chunk:
+        fingerprint = hash((fingerprint, chunk))
+        chunk = tuple(islice(records, 4096))
+    return len(hitset), fingerprint
+
+
+def recommendations_fingerprint(recommendations):
+    """Fingerprint of the recommendations of a user."""
+    if recommendations is None:
+        return None
+    if isinstance(recommendations, PackedRecommendations):
+        return recommendations.fingerprint
+    return len(recommendations), hash(frozenset(recommendations.items()))
+
+
+def config_version(config):
+    """Version of a config, the same in every process."""
+    canonical = json.dumps(config, sort_keys=True, default=repr)
+    return hashlib.md5(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def recommendations_version(recommendations):
+    """Version of the recommendations of a user, the same in every process."""
+    if recommendations is None:
+        return None
+    if isinstance(recommendations, PackedRecommendations):
+        size, checksum = recommendations.fingerprint
+        return '{0:x}-{1:08x}'.format(size, checksum & 0xffffffff)
+
+    # Order independent, so that no sorting is needed
+    checksum = 0
+    for item in recommendations.items():
+        checksum += zlib.crc32(repr(item).encode('utf-8')) & 0xffffffff
+    return '{0:x}-{1:016x}'.format(len(recommendations),
+                                   checksum & 0xffffffffffffffff)
+
+
+def recommendations_subset(recommendations, record_ids):
+    """
+    Recommendations of some records only.
+
+    :param record_ids: list with the list of records of every collection
+    :return: dictionary {recid: score} of the recommended records
+    """
+    subset = {}
+    if not recommendations:
+        return subset
+
+    for collection_result in record_ids:
+        for recid in collection_result:
+            score = recommendations.get(recid)
+            if score is not None:
+                subset[recid] = score
+    return subset
+
+
+def recommendations_as_dict(recommendations):
+    """Recommendations as a dictionary, i.e. to embed them in events."""
+    if isinstance(recommendations, PackedRecommendations):
+        return recommendations.to_dict()
+    return recommendations
+
+
 class SendToObelix(object):
 
-    """Save data to the Obelix queue."""
+    """
+    Save data to the Obelix queue.
+
+    With a ``batch_size`` above one, events are buffered per queue and
+    pushed with a single multi-value push once ``batch_size`` events are
+    buffered or ``flush_interval`` seconds passed since the last flush.
+    With a ``flush_interval``, a timer thread also flushes the buffered
+    events when no event comes to trigger the flush. Buffered events are
+    flushed at interpreter exit.
+
+    Flushes are serialized, so batches are pushed in order. Events whose
+    push fails are buffered again for the next flush and counted in
+    ``failed``; the error is raised to the caller, or logged when the
+    flush comes from the timer.
 
-    def __init__(self, queue):
+    The ``metrics`` hook gets the latency of each push and the number of
+    events, per queue.
+    """
+
+    def __init__(self, queue, batch_size=1, flush_interval=None,
+                 timer=time.time, metrics=None):
         self.queue = queue
+        self.metrics = metrics or NullMetrics()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timer = timer
+        self.buffers = {}
+        self.buffered = 0
+        self.last_flush = timer()
+        self.flush_timer = None
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.push_lock = threading.Lock()
+        _publishers.add(self)
+
+    def push(self, queue, data):
+        """Push to a queue, or buffer the event until the next flush."""
+        if self.batch_size <= 1 and self.flush_interval is None:
+            self._push_values(queue, (data,))
+            return
+
+        with self.lock:
+            self.buffers.setdefault(queue, []).append(data)
+            self.buffered += 1
+            due = (self.buffered >= self.batch_size or
+                   (self.flush_interval is not None and
+                    self.timer() - self.last_flush >= self.flush_interval))
+            if not due:
+                self._start_timer()
+        if due:
+            self.flush()
+
+    def _start_timer(self):
+        """Flush from a timer thread when idle, the lock has to be held."""
+        if self.flush_interval is not None and self.flush_timer is None:
+            self.flush_timer = threading.Timer(self.flush_interval,
+                                               self._flush_logged)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+
+    def flush(self):
+        """Push all buffered events, one push per queue."""
+        with self.push_lock:
+            with self.lock:
+                buffers = self.buffers
+                self.buffers = {}
+                self.buffered = 0
+                self.last_flush = self.timer()
+                if self.flush_timer is not None:
+                    self.flush_timer.cancel()
+                    self.flush_timer = None
+
+            error = None
+            for queue, values in buffers.items():
+                try:
+                    self._push_values(queue, values)
+                except Exception as exc:
+                    error = exc
+                    self._buffer_again(queue, values)
+
+        if error is not None:
+            raise error
+
+    def _buffer_again(self, queue, values):
+        """Put back values that could not be pushed, before the new ones."""
+        self.metrics.incr('queue.failed', len(values))
+        with self.lock:
+            self.buffers[queue] = values + self.buffers.get(queue, [])
+            self.buffered += len(values)
+            self.failed += len(values)
+            self._start_timer()
+
+    def _flush_logged(self):
+        """Flush with nobody to raise to, i.e. from the timer."""
+        try:
+            self.flush()
+        except Exception:
+            logging.getLogger('obelix_client').exception(
+                "Could not push the buffered events")
+
+    def _push_values(self, queue, values):
+        """Push the values to a queue in one push."""
+        if not self.metrics.enabled:
+            self.queue.lpush(queue, *values)
+            return
+
+        start = clock()
+        self.queue.lpush(queue, *values)
+        self.metrics.timing('queue.{0}.push'.format(queue), clock() - start)
+        self.metrics.incr('queue.{0}.events'.format(queue), len(values))
+
+    def shutdown(self):
+        """Push what is left before the interpreter exits."""
+        self._flush_logged()
 
     def statistics_search_result(self, data):
         """Push to statistics_search_result."""
-        self.queue.lpush("statistics-search-result", data)
+        self.push("statistics-search-result", data)
 
     def statistics_page_view(self, data):
         """Push to statistics_page_view."""
-        self.queue.lpush("statistics-page-view", data)
+        self.push("statistics-page-view", data)
 
     def save_to_neo_feeder(self, data):
         """Push to logentries."""
-        self.queue.lpush("logentries", data)
+        self.push("logentries", data)
+
+
+class BackgroundSendToObelix(SendToObelix):
+
+    """
+    Save data to the Obelix queue from a background thread.
+
+    Events are kept in a bounded in-memory buffer and pushed by a worker
+    thread, one multi-value push per queue for everything pending, so
+    logging never waits for the queue storage. When the buffer is full
+    the ``overflow`` policy decides what happens:
+
+    * ``'drop-oldest'``: the oldest buffered event is dropped,
+    * ``'drop-newest'``: the new event is dropped,
+    * ``'block'``: wait up to ``block_timeout`` seconds for room, then
+      drop the new event.
+
+    Dropped events are counted in ``dropped``, events the storage failed
+    to take in ``failed``. Pending events are drained at interpreter exit.
+    """
+
+    OVERFLOW_POLICIES = ('drop-oldest', 'drop-newest', 'block')
+
+    #: Seconds to wait for the pending events at interpreter exit
+    exit_timeout = 5
+
+    def __init__(self, queue, maxsize=10000, overflow='drop-oldest',
+                 block_timeout=None, metrics=None):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: {0}".format(overflow))
+
+        super(BackgroundSendToObelix, self).__init__(queue, metrics=metrics)
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.pending = deque()
+        self.in_flight = 0
+        self.dropped = 0
+        self.failed = 0
+        self.pushed = 0
+        self.closed = False
+        self.condition = threading.Condition(self.lock)
+
+        self.worker = threading.Thread(target=self._work,
+                                       name='obelix-client-publisher')
+        self.worker.daemon = True
+        self.worker.start()
+
+    def push(self, queue, data):
+        """Buffer an event for the worker thread."""
+        with self.condition:
+            if len(self.pending) >= self.maxsize:
+                if self.overflow == 'drop-oldest':
+                    self.pending.popleft()
+                    self._drop()
+                elif self.overflow == 'drop-newest':
+                    self._drop()
+                    return
+                else:
+                    self._wait(lambda: len(self.pending) < self.maxsize,
+                               self.block_timeout)
+                    if len(self.pending) >= self.maxsize:
+                        self._drop()
+                        return
+
+            self.pending.append((queue, data))
+            self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Wait until the worker pushed all pending events.
+
+        :return: True if everything was pushed within ``timeout``
+        """
+        with self.condition:
+            return self._wait(lambda: not self.pending and not self.in_flight,
+                              timeout)
+
+    def close(self, timeout=None):
+        """Drain the pending events and stop the worker thread."""
+        self.flush(timeout)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.worker.join(timeout)
+
+    def shutdown(self):
+        """Drain the pending events before the interpreter exits."""
+        self.close(self.exit_timeout)
+
+    def _drop(self):
+        """Count a dropped event."""
+        self.dropped += 1
+        self.metrics.incr('queue.dropped')
+
+    def _wait(self, predicate, timeout):
+        """Wait on the condition until predicate is true or timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        while not predicate():
+            if deadline is None:
+                self.condition.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def _work(self):
+        """Push the pending events, grouped per queue."""
+        while True:
+            with self.condition:
+                self._wait(lambda: self.pending or self.closed, None)
+                if self.closed and not self.pending:
+                    return
+                batch = self.pending
+                self.pending = deque()
+                self.in_flight = len(batch)
+                # There is room again for blocked producers
+                self.condition.notify_all()
+
+            buffers = {}
+            for queue, data in batch:
+                buffers.setdefault(queue, []).append(data)
+
+            pushed = failed = 0
+            for queue, values in buffers.items():
+                try:
+                    self._push_values(queue, values)
+                    pushed += len(values)
+                except Exception:
+                    failed += len(values)
+                    self.metrics.incr('queue.failed', len(values))
+                    logging.getLogger('obelix_client').exception(
+                        "Could not push %d events to %s", len(values), queue)
+
+            with self.condition:
+                self.pushed += pushed
+                self.failed += failed
+                self.in_flight = 0
+                self.condition.notify_all()
+
+
+_publishers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_publishers():
+    """Flush the events still buffered at interpreter exit."""
+    for publisher in list(_publishers):
+        publisher.shutdown()
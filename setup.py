@@ -25,7 +25,7 @@ from setuptools import setup
 from setuptools.command.test import test as TestCommand
 
 requirements = [
-    'msgpack-python',
+    'msgpack>=1.0',
 ]
 
 test_requirements = [
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+import asyncio
+import json
+import unittest
+
+from obelix_client.aio import AsyncObelix, AsyncRedisMock, AsyncRedisQueue, \
+    AsyncRedisStorage
+from obelix_client.api import Obelix
+from obelix_client.queue import RedisQueue
+from obelix_client.storage import RedisMock, RedisStorage
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncObelix(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = AsyncRedisStorage(AsyncRedisMock(), prefix='pre::',
+                                       encoder=json)
+        self.recommendations = AsyncRedisStorage(AsyncRedisMock(),
+                                                 'recommendations::')
+        self.queues = AsyncRedisQueue(AsyncRedisMock(), encoder=json)
+        self.obelix = AsyncObelix(self.cache, self.recommendations,
+                                  self.queues)
+
+    def test_save_settings(self):
+        run(self.obelix.save_settings())
+        settings = run(self.cache.get("settings"))
+        assert settings['recommendations_impact'] == 0.5
+
+    def test_rank_records_same_as_blocking(self):
+        uid = 1
+        hitset = range(1, 30)
+        pre_reco = {5: 0.5, 20: 1.0}
+        run(self.recommendations.set(uid, pre_reco))
+
+        recommendations = RedisStorage(RedisMock(), 'recommendations::')
+        recommendations.set(uid, pre_reco)
+        obelix = Obelix(RedisStorage(RedisMock()), recommendations,
+                        RedisQueue(RedisMock()))
+
+        for jrec in (0, 11, 21):
+            assert run(self.obelix.rank_records(hitset, uid, 10, jrec)) == \
+                obelix.rank_records(hitset, uid, 10, jrec)
+
+        requests = [(hitset, uid), (hitset, 2, 10, 11)]
+        assert run(self.obelix.rank_records_batch(requests)) == \
+            obelix.rank_records_batch(requests)
+
+    def test_log_search_result_and_page_view(self):
+        user_info = {'uid': 1, 'remote_ip': "127.0.0.1", "uri": "testuri"}
+        record_ids = [[1, 88], [1, 2]]
+
+        run(self.obelix.log('search_result', user_info, record_ids,
+                            record_ids, [[0.3, 0.5], [0.5, 0.2]],
+                            ["Thesis", "Another"], 2, 0, 10,
+                            "recommendations", "obelix"))
+        run(self.obelix.log('page_view', user_info, 88))
+
+        last_search = run(self.cache.get("last-search-result::1"))
+        assert last_search['record_ids'] == record_ids
+        logged = run(self.queues.rpop("statistics-search-result"))
+        assert logged['uid'] == 1
+        logged = run(self.queues.rpop("statistics-page-view"))
+        assert logged['hit_number_local'] == 1
+        logged = run(self.queues.rpop("logentries"))
+        assert logged['type'] == "events.pageviews"
+
+    def test_log_download_after_search(self):
+        user_info = {'uid': 5, 'remote_ip': "127.0.0.1", "uri": "testuri.pdf"}
+
+        run(self.obelix.log('download_after_search', user_info, 88))
+
+        logged = run(self.queues.lpop("logentries"))
+        assert logged['type'] == "events.downloads"
+        assert logged['file_format'] == "pdf"
+
+
+class TestAsyncRedisQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = AsyncRedisQueue(AsyncRedisMock(), encoder=json)
+
+    def test_brpop_many(self):
+        queue = self.queue
+        assert run(queue.brpop_many("q1", 5, timeout=0.01)) == []
+
+        run(queue.lpush("q1", 1, 2, 3))
+        assert run(queue.brpop_many("q1", 2, timeout=1)) == [1, 2]
+        assert run(queue.brpop_many("q1", 2, timeout=1)) == [3]
+
+    def test_brpop_many_waits(self):
+        queue = self.queue
+
+        async def push_later():
+            await asyncio.sleep(0.02)
+            await queue.lpush("q1", "late")
+
+        async def pop():
+            pushing = asyncio.ensure_future(push_later())
+            values = await queue.brpop_many("q1", 5, timeout=5)
+            await pushing
+            return values
+
+        assert run(pop()) == ["late"]
+
+    def test_iter_drain(self):
+        queue = self.queue
+        for i in range(0, 25):
+            run(queue.lpush("q1", i))
+
+        async def drain():
+            return [value async for value in
+                    queue.iter_drain("q1", batch_size=10)]
+
+        assert run(drain()) == list(range(25))
+        assert run(drain()) == []
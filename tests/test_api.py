@@ -19,8 +19,11 @@
 
 import json
 import unittest
+from array import array
 
+from obelix_client import utils as obelix_utils
 from obelix_client.api import Obelix
+from obelix_client.metrics import CallbackMetrics
 from obelix_client.queue import RedisQueue
 from obelix_client.storage import RedisMock, RedisStorage
 
@@ -190,6 +193,135 @@ class TestObelix(unittest.TestCase):
         assert pre2 == result2
         assert pre3 == result3
 
+    def test_rank_records_numpy_engine(self):
+        if obelix_utils.numpy is None:
+            self.skipTest("NumPy is not installed")
+        obelix = Obelix(self.cache, self.recommendations, self.queues,
+                        {'scoring_engine': 'numpy'})
+        uid = 1
+        hitset = range(1, 300)
+        self.recommendations.set(uid, {5: 0.5, 20: 1.0, 250: 0.1})
+
+        for jrec in (0, 11, 21, 291):
+            assert obelix.rank_records(hitset, uid, 10, jrec) == \
+                self.obelix.rank_records(hitset, uid, 10, jrec)
+
+    def test_rank_records_numpy_engine_json_recommendations(self):
+        if obelix_utils.numpy is None:
+            self.skipTest("NumPy is not installed")
+        # JSON turns the recids of the recommendations into strings
+        recommendations = RedisStorage(RedisMock(), 'recommendations::',
+                                       encoder=json)
+        recommendations.set(1, {5: 0.9, 7: 1.0, 'abc': 1.0})
+        hitset = list(range(1, 10))
+        python = Obelix(self.cache, recommendations, self.queues)
+        numpy = Obelix(self.cache, recommendations, self.queues,
+                       {'scoring_engine': 'numpy'})
+        assert numpy.rank_records(hitset, 1) == \
+            python.rank_records(hitset, 1)
+        assert python.rank_records(hitset, 1)[0][:3] == [9, 8, 7]
+
+    def test_rank_records_unhashable_config(self):
+        obelix = Obelix(self.cache, self.recommendations, self.queues,
+                        {'compact_user_info_keys': ['guest']})
+        self.recommendations.set(1, {5: 0.5, 20: 1.0})
+        assert obelix.rank_records(range(1, 30), 1) == \
+            self.obelix.rank_records(range(1, 30), 1)
+        assert obelix.ranked_cache.misses == 1
+
+    def test_rank_records_cached_pages(self):
+        obelix = Obelix(self.cache, self.recommendations, self.queues,
+                        {'ranked_cache_pages': 2})
+        uid = 1
+        hitset = range(1, 100)
+        self.recommendations.set(uid, {5: 0.5, 20: 1.0})
+
+        uncached = Obelix(self.cache, self.recommendations, self.queues,
+                          {'ranked_cache_size': 0})
+        for jrec in (0, 11, 21, 31, 91):
+            assert obelix.rank_records(hitset, uid, 10, jrec) == \
+                uncached.rank_records(hitset, uid, 10, jrec)
+        # Every page after the first finds the cached ranking, pages three
+        # and ten are ranked again because they are not in it yet
+        assert obelix.ranked_cache.hits == 4
+        assert uncached.ranked_cache.hits == 0
+
+        # New recommendations are not served from the cache
+        assert obelix.rank_records(hitset, uid, 10, 0,
+                                   recommendations={90: 1.0})[0][0] == 90
+
+    def test_rank_records_hitset_types(self):
+        self.recommendations.set(1, {5: 0.5, 20: 1.0, 48: 0.2})
+        expected = self.obelix.rank_records(list(range(1, 50)), 1)
+        for hitset in (range(1, 50), tuple(range(1, 50)),
+                       array('l', range(1, 50)), iter(range(1, 50)),
+                       (recid for recid in range(1, 50))):
+            obelix = Obelix(self.cache, self.recommendations, self.queues)
+            assert obelix.rank_records(hitset, 1) == expected
+
+    def test_rank_records_fingerprints_once_per_fetch(self):
+        calls = []
+        fingerprint = obelix_utils.recommendations_fingerprint
+
+        def counting(recommendations):
+            calls.append(recommendations)
+            return fingerprint(recommendations)
+
+        self.recommendations.set(1, {5: 0.5, 20: 1.0})
+        uncached = Obelix(self.cache, self.recommendations, self.queues,
+                          {'ranked_cache_size': 0})
+        obelix_utils.recommendations_fingerprint = counting
+        try:
+            for jrec in (0, 11, 21):
+                self.obelix.rank_records(range(1, 30), 1, 10, jrec)
+                self.obelix.rank_records(range(1, 40), 1, 10, jrec)
+            assert len(calls) == 1
+            uncached.rank_records(range(1, 30), 1)
+            uncached.rank_records_batch([(range(1, 30), 1)])
+            assert len(calls) == 1
+        finally:
+            obelix_utils.recommendations_fingerprint = fingerprint
+        assert len(uncached.ranked_cache) == 0
+
+    def test_rank_records_batch(self):
+        self.recommendations.set(1, {5: 0.5, 20: 1.0})
+        self.recommendations.set(2, {7: 0.3})
+        requests = [(range(1, 30), 1), (range(1, 30), 2, 5, 6),
+                    (range(10, 39), 3), ([4, 5, 6], 1, 2),
+                    (range(1, 30), 1, 10, 11)]
+
+        uncached = Obelix(self.cache, self.recommendations, self.queues,
+                          {'ranked_cache_size': 0})
+        expected = [uncached.rank_records(*request) for request in requests]
+        assert self.obelix.rank_records_batch(requests) == expected
+        # The last request shares the ranking of the first one
+        assert len(self.obelix.ranked_cache) == 4
+        assert self.obelix.rank_records_batch(requests) == expected
+        assert self.obelix.ranked_cache.hits == 5
+        assert uncached.rank_records_batch(requests, processes=2) == \
+            expected
+
+    def test_rank_records_metrics(self):
+        events = []
+        obelix = Obelix(self.cache, self.recommendations, self.queues,
+                        metrics=CallbackMetrics(
+                            lambda *event: events.append(event)))
+        self.recommendations.set(1, {5: 0.5})
+        obelix.rank_records(list(range(1, 50)), 1)
+        obelix.rank_records(list(range(1, 50)), 1)
+
+        timings = [name for kind, name, _ in events if kind == 'timing']
+        assert timings == ['rank.reverse', 'rank.fetch', 'rank.order',
+                           'rank.blend', 'rank.sort', 'rank.total',
+                           'rank.reverse', 'rank.fetch', 'rank.total']
+        assert ('incr', 'cache.ranked.hit', 1) in events
+        assert ('incr', 'cache.recommendations.hit', 1) in events
+        assert events[-1][2] == obelix.last_rank_seconds
+
+        del events[:]
+        obelix.report_metrics()
+        assert ('gauge', 'cache.ranked.hit_ratio', 0.5) in events
+
 
 class TestObelixLogging(unittest.TestCase):
 
@@ -322,3 +454,218 @@ class TestObelixLogging(unittest.TestCase):
         logged = self.queues.lpop("logentries")
         assert logged['type'] == "events.downloads"
         assert str(logged['user']) == '5'
+
+    def test_log_page_view_background_queue(self):
+        obelix = Obelix(self.cache, self.recommendations, self.queues,
+                        {'queue_mode': 'background'})
+        user_info = {'uid': 1, 'remote_ip': "127.0.0.1", "uri": "testuri"}
+
+        obelix.log('page_view', user_info, 1)
+        obelix.flush()
+
+        logged = self.queues.lpop("logentries")
+        assert logged['type'] == "events.pageviews"
+        assert str(logged['user']) == '1'
+
+    def test_recommendations_fetched_once(self):
+        fetched = []
+
+        class CountingRedisMock(RedisMock):
+            def get(self, key, default=None):
+                fetched.append(key)
+                return super(CountingRedisMock, self).get(key, default)
+
+        recommendations = RedisStorage(CountingRedisMock(),
+                                       'recommendations::')
+        recommendations.set(1, {1: 0.5, 88: 1.0})
+        obelix = Obelix(self.cache, recommendations, self.queues)
+        user_info = {'uid': 1, 'remote_ip': "127.0.0.1", "uri": "testuri"}
+        record_ids = [[1, 88], [1, 2]]
+
+        obelix.rank_records([1, 2, 88], 1)
+        obelix.log('search_result', user_info, record_ids, record_ids,
+                   [[0.3, 0.5], [0.5, 0.2]], ["Thesis", "Another"], 2,
+                   0, 10, "recommendations", "obelix")
+        obelix.log('page_view', user_info, 1)
+        assert fetched == ['recommendations::1']
+
+        logged = self.queues.rpop("statistics-page-view")
+        assert logged['recommendations'] == {'1': 0.5, '88': 1.0}
+        assert logged['recid_in_recommendations']
+
+        # Already fetched recommendations are used as they are
+        obelix.log('page_view', user_info, 88, recommendations={1: 0.1})
+        assert fetched == ['recommendations::1']
+        logged = self.queues.lpop("statistics-page-view")
+        assert logged['recommendations'] == {'1': 0.1}
+        assert not logged['recid_in_recommendations']
+
+    def test_log_page_view_hit_numbers(self):
+        user_info = {'uid': 1, 'remote_ip': "127.0.0.1", "uri": "testuri"}
+        record_ids = [[1, 88, 5], [7, 1, 2, 5]]
+        indexed = Obelix(self.cache, self.recommendations, self.queues,
+                         {'last_search_index': True})
+
+        for obelix in (indexed, self.obelix):
+            obelix.log('search_result', user_info, record_ids, record_ids,
+                       [], [], 2, 1, 10, "recommendations", "obelix")
+            for recid in (1, 88, 5, 2, 3):
+                obelix.log('page_view', user_info, recid)
+
+        events = list(self.queues.iter_drain("statistics-page-view"))
+        hits = [(event['recid'], event['hit_number_local'],
+                 event['hit_number_global']) for event in events]
+        assert hits[:6] == [(1, 1, 1), (1, 2, 5), (88, 2, 2),
+                            (5, 3, 3), (5, 4, 9), (2, 3, 6)]
+        assert hits[:6] == hits[6:]
+
+    def test_log_search_result_storage_without_ttl(self):
+        class DictStorage(dict):
+            def set(self, key, value):
+                self[key] = value
+
+        cache = DictStorage()
+        obelix = Obelix(cache, self.recommendations, self.queues)
+        user_info = {'uid': 1, 'remote_ip': "127.0.0.1", "uri": "testuri"}
+        obelix.log('search_result', user_info, [[1, 2]], [[1, 2]],
+                   [], [], 2, 1, 10, "recommendations", "obelix")
+        assert cache["last-search-result::1"]['record_ids'] == [[1, 2]]
+
+    def test_log_page_view_index_equals_scan(self):
+        user_info = {'uid': 1, 'remote_ip': "127.0.0.1", "uri": "testuri"}
+        record_ids = [list(range(1, 101)), list(range(0, 100))]
+        indexed = Obelix(self.cache, self.recommendations, self.queues,
+                         {'last_search_index': True})
+
+        hits = []
+        for obelix in (self.obelix, indexed):
+            obelix.log('search_result', user_info, record_ids, record_ids,
+                       [], [], 2, 21, 10, "recommendations", "obelix")
+            for recid in (25, 20):
+                obelix.log('page_view', user_info, recid)
+            hits.append([(event['recid'], event['hit_number_local'],
+                          event['hit_number_global']) for event in
+                         self.queues.iter_drain("statistics-page-view")])
+
+        scan, index = hits
+        assert scan == [(25, 45, 45), (25, 46, 170),
+                        (20, 40, 40), (20, 41, 160)]
+        # 20 is only shown in the second collection, numbered the same
+        assert index == [(25, 45, 45), (25, 46, 170), (20, 41, 160)]
+
+    def test_log_page_view_index_apart(self):
+        redis = RedisMock()
+        cache = RedisStorage(redis, prefix='pre::', encoder=json)
+        obelix = Obelix(cache, self.recommendations, self.queues,
+                        {'last_search_index': True})
+        user_info = {'uid': 1, 'remote_ip': "127.0.0.1", "uri": "testuri"}
+        record_ids = [list(range(1, 101))]
+
+        obelix.log('search_result', user_info, record_ids, record_ids,
+                   [], [], 2, 11, 10, "recommendations", "obelix")
+
+        # The last search is kept whole, the index only has the shown page
+        last_search = cache.get("last-search-result::1")
+        assert last_search['record_ids'] == record_ids
+        assert 'record_index' not in last_search
+        page = cache.get("last-search-page::1")
+        assert 'record_ids' not in page
+        assert sorted(map(int, page['record_index'])) == list(range(11, 21))
+
+        # Page views only read the index
+        redis.delete('pre::last-search-result::1')
+        for recid in (15, 50):
+            obelix.log('page_view', user_info, recid)
+        events = list(self.queues.iter_drain("statistics-page-view"))
+        assert [(event['recid'], event['hit_number_local'])
+                for event in events] == [(15, 11 + 14)]
+
+    def test_log_search_result_trimmed(self):
+        redis = RedisMock()
+        cache = RedisStorage(redis, prefix='pre::', encoder=json)
+        obelix = Obelix(cache, self.recommendations, self.queues,
+                        {'last_search_trim': True, 'last_search_ttl': 60})
+        user_info = {'uid': 1, 'remote_ip': "127.0.0.1", "uri": "testuri"}
+        record_ids = [list(range(1, 101)), list(range(50, 150))]
+
+        obelix.log('search_result', user_info, record_ids, record_ids,
+                   [], [], 2, 21, 10, "recommendations", "obelix")
+
+        last_search = cache.get("last-search-result::1")
+        assert last_search['record_ids'] == [list(range(21, 31)),
+                                             list(range(70, 80))]
+        assert last_search['record_offsets'] == [20, 20]
+        assert last_search['record_counts'] == [100, 100]
+        assert 'pre::last-search-result::1' in redis.expires
+
+        for recid in (25, 75, 5):
+            obelix.log('page_view', user_info, recid)
+        events = list(self.queues.iter_drain("statistics-page-view"))
+        hits = [(event['recid'], event['hit_number_local'],
+                 event['hit_number_global']) for event in events]
+        # 75 was only shown in the second collection, 5 was not shown; the
+        # global hit numbers are the ones of all the results
+        assert hits == [(25, 21 + 24, 21 + 24), (75, 21 + 25, 21 + 199)]
+
+    def test_log_compact_events(self):
+        obelix = Obelix(self.cache, self.recommendations, self.queues,
+                        {'compact_events': True})
+        self.recommendations.set(1, {1: 0.5, 88: 1.0, 1000: 0.2})
+        user_info = {'uid': 1, 'remote_ip': "127.0.0.1", "uri": "testuri",
+                     'agent': "browser", 'email': "user@example.org"}
+        record_ids = [[1, 88], [1, 2]]
+
+        obelix.log('search_result', user_info, record_ids, record_ids,
+                   [], [], 2, 0, 10, "recommendations", "obelix")
+        obelix.log('page_view', user_info, 2)
+        obelix.log('page_view', user_info, 88)
+
+        logged = self.queues.rpop("statistics-search-result")
+        assert 'settings' not in logged
+        settings = self.cache.get(
+            "settings::{0}".format(logged['settings_version']))
+        assert settings['compact_events'] is True
+        assert logged['recommendations'] == {'1': 0.5, '88': 1.0}
+        version = logged['recommendations_version']
+        assert version
+
+        not_recommended, recommended = \
+            self.queues.iter_drain("statistics-page-view")
+        assert not_recommended['recommendations'] == {}
+        assert recommended['recommendations'] == {'88': 1.0}
+        assert recommended['recommendations_version'] == version
+        assert recommended['user_info'] == {'agent': "browser"}
+
+    def test_log_compact_events_shown_records(self):
+        obelix = Obelix(self.cache, self.recommendations, self.queues,
+                        {'compact_events': True})
+        self.recommendations.set(1, {5: 0.5, 900: 1.0})
+        user_info = {'uid': 1, 'remote_ip': "127.0.0.1", "uri": "testuri"}
+        record_ids = [list(range(1, 1001))]
+
+        obelix.log('search_result', user_info, record_ids, record_ids,
+                   [], [], 2, 1, 10, "recommendations", "obelix")
+
+        # 900 is recommended but not on the shown page
+        logged = self.queues.rpop("statistics-search-result")
+        assert logged['recommendations'] == {'5': 0.5}
+
+    def test_log_metrics(self):
+        events = []
+        metrics = CallbackMetrics(lambda *event: events.append(event))
+        queues = RedisQueue(RedisMock(), encoder=json, metrics=metrics)
+        obelix = Obelix(self.cache, self.recommendations, queues,
+                        metrics=metrics)
+        obelix.rank_records([1, 2, 3], 1)
+
+        obelix.log('search_result', {'uid': 1}, [], [[1, 2, 3]], [], [],
+                   None, 0, 10, "recommendations", "obelix")
+
+        logged = queues.rpop("statistics-search-result")
+        assert logged['seconds_to_rank_and_print'] == \
+            obelix.last_rank_seconds
+        names = [name for _, name, _ in events]
+        assert 'queue.statistics-search-result.push' in names
+        assert ('incr', 'queue.statistics-search-result.events', 1) in events
+        assert ('incr', 'queue.statistics-search-result.bytes',
+                len(json.dumps(logged))) in events
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+import unittest
+
+from obelix_client.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert (cache.hits, cache.misses) == (3, 1)
+
+    def test_ttl(self):
+        now = [100.0]
+        cache = LRUCache(maxsize=10, ttl=5, timer=lambda: now[0])
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=60)
+        now[0] += 10
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+        assert "a" not in cache
+
+    def test_set_purges_expired(self):
+        now = [100.0]
+        cache = LRUCache(maxsize=10, ttl=5, timer=lambda: now[0])
+        for key in range(5):
+            cache.set(key, [key] * 100)
+        now[0] += 10
+        cache.set("a", 1)
+        # Expired entries do not wait for a lookup to be released
+        assert len(cache) == 1
+        assert cache.get("a") == 1
+
+    def test_sizeof(self):
+        cache = LRUCache(maxsize=10, sizeof=len)
+        cache.set("a", "x" * 4)
+        cache.set("b", "x" * 4)
+        cache.set("c", "x" * 4)
+        # The size is bounded, not the number of entries
+        assert "a" not in cache
+        assert cache.size == 8
+        cache.set("big", "x" * 11)
+        assert "big" not in cache
+        cache.delete("b")
+        assert (len(cache), cache.size) == (1, 4)
+
+    def test_peek(self):
+        now = [100.0]
+        cache = LRUCache(maxsize=2, ttl=5, timer=lambda: now[0])
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.peek("a") == 1
+        # Not counted and not moved, "a" is still the next one evicted
+        assert (cache.hits, cache.misses) == (0, 0)
+        cache.set("c", 3)
+        assert cache.peek("a") is None
+        now[0] += 10
+        assert cache.peek("b", 0) == 0
+
+    def test_disabled(self):
+        cache = LRUCache(maxsize=0)
+        cache.set("a", 1)
+        assert cache.get("a") is None
+        assert len(cache) == 0
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+import json
+import unittest
+
+from obelix_client import encoders
+from obelix_client.queue import RedisQueue
+from obelix_client.storage import RedisMock, RedisStorage
+
+EVENT = {'recid': 88, 'uid': 1, 'uri': "/record/88", 'jrec': 0,
+         'recommendations': {'88': 1.0}, 'user_info': {'agent': u"ü"}}
+
+
+class TestEncoders(unittest.TestCase):
+
+    def test_msgpack(self):
+        if encoders.msgpack is None:
+            self.skipTest("msgpack is not installed")
+        encoder = encoders.MsgpackEncoder()
+        data = encoder.dumps(EVENT)
+        assert encoder.loads(data) == EVENT
+        assert encoder.loads(memoryview(data)) == EVENT
+        # Recommendations keep their integer recids
+        assert encoder.loads(encoder.dumps({5: 0.5})) == {5: 0.5}
+        assert encoder.loads(encoder.dumps(b'\x00')) == b'\x00'
+
+    def test_msgpack_before_1_0(self):
+        if encoders.msgpack is None:
+            self.skipTest("msgpack is not installed")
+        msgpack = encoders.msgpack
+
+        class OldMsgpack(object):
+            """msgpack 0.5, without strict_map_key."""
+            packb = staticmethod(msgpack.packb)
+
+            @staticmethod
+            def unpackb(data, raw=True):
+                return msgpack.unpackb(data, raw=raw, strict_map_key=False)
+
+        encoders.msgpack = OldMsgpack
+        try:
+            encoder = encoders.MsgpackEncoder()
+            assert encoder.loads(encoder.dumps({5: 0.5})) == {5: 0.5}
+        finally:
+            encoders.msgpack = msgpack
+
+    def test_json(self):
+        for encoder in (encoders.JsonEncoder(),
+                        encoders.JsonEncoder(backend=json)):
+            data = encoder.dumps(EVENT)
+            assert encoder.loads(data) == EVENT
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+            assert encoder.loads(memoryview(data)) == EVENT
+
+    def test_recid_list(self):
+        encoder = encoders.RecidListEncoder()
+        recids = [1, 5, 2 ** 40, 3]
+        data = encoder.dumps(recids)
+        decoded = encoder.loads(data)
+        assert len(decoded) == 4
+        assert list(decoded) == recids
+        assert 2 ** 40 in decoded
+        assert 4 not in decoded
+        assert decoded[2] == 2 ** 40
+        assert list(encoder.loads(memoryview(data))) == recids
+        assert list(encoder.loads(encoder.dumps([]))) == []
+
+    def test_get_encoder(self):
+        assert encoders.get_encoder('json').loads(
+            encoders.get_encoder('json').dumps([1])) == [1]
+        assert isinstance(encoders.get_encoder('recid-list'),
+                          encoders.RecidListEncoder)
+        self.assertRaises(ValueError, encoders.get_encoder, 'xml')
+
+    def test_with_storage_and_queue(self):
+        encoder = encoders.get_encoder()
+        storage = RedisStorage(RedisMock(), prefix='pre::', encoder=encoder)
+        storage.set("event", EVENT)
+        assert storage.get("event") == EVENT
+
+        queue = RedisQueue(RedisMock(), encoder=encoder)
+        queue.lpush("q1", EVENT)
+        assert queue.rpop("q1") == EVENT
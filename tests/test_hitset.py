@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+import pickle
+import unittest
+from array import array
+
+from obelix_client import hitset as obelix_hitset
+from obelix_client.hitset import ReversedHitset, SortedHitset, as_hitset
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#: Sorted ranges are only recognised on Python 3, buffers with NumPy too
+DETECTS_RANGES = obelix_hitset._TYPED_VIEWS
+DETECTS_BUFFERS = DETECTS_RANGES and numpy is not None
+
+
+class TestHitset(unittest.TestCase):
+
+    def test_sorted_hitsets(self):
+        for records, detected in ((array('l', [2, 3, 5, 8]), DETECTS_BUFFERS),
+                                  (range(2, 9, 3), DETECTS_RANGES)):
+            if detected:
+                assert isinstance(as_hitset(records), SortedHitset)
+            hitset = SortedHitset(records)
+            assert list(hitset) == list(reversed(records))
+            assert hitset.position(records[0]) == len(records) - 1
+            assert hitset.position(4) is None
+            assert records[1] in hitset and 4 not in hitset
+
+    def test_unsorted_hitsets(self):
+        for records in ([2, 3, 5], array('l', [3, 2, 5]),
+                        array('l', [2, 2, 5]), iter([2, 3, 5])):
+            hitset = as_hitset(records)
+            assert type(hitset) is ReversedHitset
+
+    def test_buffers_without_numpy(self):
+        # Checking a buffer record by record would cost more than it saves
+        numpy_module = obelix_hitset.numpy
+        obelix_hitset.numpy = None
+        try:
+            hitset = as_hitset(array('l', [2, 3, 5]))
+        finally:
+            obelix_hitset.numpy = numpy_module
+        assert type(hitset) is ReversedHitset
+        assert list(hitset) == [5, 3, 2]
+
+    def test_prebuilt_hitset(self):
+        hitset = SortedHitset(array('l', [2, 3, 5]))
+        assert as_hitset(hitset) is hitset
+
+    def test_intersection(self):
+        hitset = SortedHitset(array('l', range(0, 100, 2)))
+        assert hitset.intersection({4: 1.0, 5: 1.0, 98: 0.5, '6': 0.1}) == \
+            [(0, 98), (47, 4)]
+
+    @unittest.skipIf(not DETECTS_RANGES, "Buffers are walked on Python 2")
+    def test_fingerprint(self):
+        fingerprint = SortedHitset(array('l', [2, 3, 5])).fingerprint
+        assert fingerprint == SortedHitset(array('l', [2, 3, 5])).fingerprint
+        assert fingerprint != SortedHitset(array('l', [2, 3, 6])).fingerprint
+        assert SortedHitset(range(1, 9)).fingerprint != \
+            SortedHitset(range(1, 9, 2)).fingerprint
+
+    def test_pickle(self):
+        for hitset in (SortedHitset(array('l', [2, 3, 5])),
+                       as_hitset([2, 3, 5])):
+            assert list(pickle.loads(pickle.dumps(hitset))) == [5, 3, 2]
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_numpy_hitset(self):
+        hitset = as_hitset(numpy.arange(1, 10, dtype=numpy.int64))
+        assert isinstance(hitset, SortedHitset)
+        assert [type(recid) for recid in hitset] == [int] * 9
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_non_native_numpy_hitset(self):
+        # Views can not index a byte order other than the native one
+        records = numpy.arange(1, 30, dtype='>i8')
+        hitset = as_hitset(records)
+        assert type(hitset) is ReversedHitset
+        assert list(hitset) == list(range(29, 0, -1))
+
+    @unittest.skipIf(obelix_hitset.intbitset is None,
+                     "intbitset is not installed")
+    def test_intbitset(self):
+        records = obelix_hitset.intbitset([2, 3, 5, 8])
+        hitset = as_hitset(records)
+        assert isinstance(hitset, SortedHitset)
+        assert list(hitset) == [8, 5, 3, 2]
+        assert hitset.intersection([3, 4, 8]) == [(0, 8), (2, 3)]
+        assert hitset.fingerprint
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+import unittest
+
+from obelix_client.metrics import CallbackMetrics, NullMetrics, \
+    StatsdMetrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_null_metrics(self):
+        metrics = NullMetrics()
+        assert not metrics.enabled
+        metrics.incr('a')
+        metrics.gauge('a', 1)
+        with metrics.timer('a'):
+            pass
+
+    def test_callback_metrics(self):
+        events = []
+        metrics = CallbackMetrics(lambda *event: events.append(event), 'x.')
+        metrics.incr('a')
+        metrics.gauge('b', 2)
+        with metrics.timer('c') as timer:
+            pass
+
+        assert events[:2] == [('incr', 'x.a', 1), ('gauge', 'x.b', 2)]
+        assert events[2] == ('timing', 'x.c', timer.seconds)
+
+    def test_statsd_metrics(self):
+        class Client(object):
+            def __init__(self):
+                self.sent = []
+
+            def incr(self, name, value):
+                self.sent.append(('incr', name, value))
+
+            def gauge(self, name, value):
+                self.sent.append(('gauge', name, value))
+
+            def timing(self, name, value):
+                self.sent.append(('timing', name, value))
+
+        client = Client()
+        metrics = StatsdMetrics(client)
+        metrics.incr('a', 3)
+        metrics.timing('b', 0.5)
+
+        assert client.sent == [('incr', 'obelix.a', 3),
+                               ('timing', 'obelix.b', 500)]
@@ -18,6 +18,7 @@
 # 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
 
 import json
+import threading
 import unittest
 
 from obelix_client.queue import RedisQueue
@@ -103,3 +104,109 @@ class TestQueue(unittest.TestCase):
         for i in range(0, 12):
             assert queue.rpop("One") == i
             assert queue.rpop("Two") == i+30
+
+    def test_redis_queue_multi_value_push(self):
+        queue = RedisQueue(RedisMock(), prefix='pre::', encoder=json)
+        queue.lpush("q1", 1, {"two": 2}, [3])
+        queue.rpush("q2", 1, {"two": 2}, [3])
+
+        assert queue.rpop("q1") == 1
+        assert queue.rpop("q1") == {"two": 2}
+        assert queue.rpop("q1") == [3]
+
+        assert queue.lpop("q2") == 1
+        assert queue.lpop("q2") == {"two": 2}
+        assert queue.lpop("q2") == [3]
+
+    def test_rpop_many(self):
+        queue = RedisQueue(RedisMock(), prefix='pre::', encoder=json)
+        for i in range(0, 10):
+            queue.lpush("q1", {"i": i})
+
+        assert queue.rpop_many("q1", 3) == [{"i": 0}, {"i": 1}, {"i": 2}]
+        assert queue.rpop_many("q1", 100) == [{"i": i} for i in range(3, 10)]
+        assert queue.rpop_many("q1", 3) == []
+        assert queue.rpop_many("nothing", 3) == []
+
+    def test_brpop_many(self):
+        queue = RedisQueue(RedisMock(), encoder=json)
+        assert queue.brpop_many("q1", 5, timeout=0.01) == []
+
+        queue.lpush("q1", 1, 2, 3)
+        assert queue.brpop_many("q1", 2, timeout=1) == [1, 2]
+        assert queue.brpop_many("q1", 2, timeout=1) == [3]
+
+    def test_iter_drain(self):
+        queue = RedisQueue(RedisMock(), encoder=json)
+        for i in range(0, 25):
+            queue.lpush("q1", i)
+
+        assert list(queue.iter_drain("q1", batch_size=10)) == list(range(25))
+        assert list(queue.iter_drain("q1", batch_size=10)) == []
+
+    def test_redis_mock_lpop_count(self):
+        queue = RedisMock()
+        queue.rpush("q1", 1, 2, 3)
+        assert queue.lpop("q1", 2) == [1, 2]
+        assert queue.lpop("q1", 2) == [3]
+        assert queue.lpop("q1", 2) is None
+
+    def test_redis_mock_llen_lrange(self):
+        queue = RedisMock()
+        queue.rpush("q1", 1, 2, 3, 4)
+        assert queue.llen("q1") == 4
+        assert queue.llen("nothing") == 0
+        assert queue.lrange("q1", 0, -1) == [1, 2, 3, 4]
+        assert queue.lrange("q1", 1, 2) == [2, 3]
+        assert queue.lrange("q1", -2, 10) == [3, 4]
+        assert queue.lrange("q1", 3, 1) == []
+
+    def test_redis_mock_pipeline(self):
+        queue = RedisMock()
+        pipe = queue.pipeline()
+        pipe.lpush("q1", 1, 2).llen("q1").set("key", "value").get("key")
+        assert queue.llen("q1") == 0
+        assert pipe.execute() == [2, 2, None, "value"]
+        assert queue.rpop("q1") == 1
+
+    def test_redis_mock_expire(self):
+        queue = RedisMock()
+        queue.rpush("q1", 1)
+        queue.set("key", "value", ex=-1)
+        assert queue.get("key") is None
+        assert queue.expire("q1", -1)
+        assert queue.llen("q1") == 0
+        assert not queue.expire("nothing", 10)
+
+    def test_redis_mock_brpop_waits(self):
+        queue = RedisMock()
+        timer = threading.Timer(0.05, queue.lpush, ("q1", "late"))
+        timer.start()
+        assert queue.brpop(["q0", "q1"], timeout=5) == ("q1", "late")
+        timer.join()
+
+    def test_redis_mock_concurrent_push_pop(self):
+        queue = RedisMock()
+        popped = []
+
+        def produce(offset):
+            for i in range(2000):
+                queue.lpush("q1", offset + i)
+
+        def consume():
+            while len(popped) < 8000:
+                item = queue.brpop("q1", timeout=5)
+                if item is None:
+                    return
+                popped.append(item[1])
+
+        threads = [threading.Thread(target=produce, args=(i * 10000,))
+                   for i in range(4)]
+        threads.append(threading.Thread(target=consume))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        assert sorted(popped) == sorted(i * 10000 + j for i in range(4)
+                                        for j in range(2000))
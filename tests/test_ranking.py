@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+import random
+import sys
+import unittest
+from array import array
+
+from obelix_client import ranking, utils
+from obelix_client.api import CONFIG
+from obelix_client.hitset import SortedHitset, as_hitset
+from obelix_client.metrics import NullMetrics
+from obelix_client.recommendations import PackedRecommendations, \
+    pack_recommendations
+
+#: Ties are broken by insertion order only where dictionaries keep it
+ORDERED_DICTS = sys.version_info >= (3, 6)
+
+
+class TestRankingStrategies(unittest.TestCase):
+
+    def choose(self, hitset, recommendations, **config):
+        return ranking.choose_strategy(dict(CONFIG, **config),
+                                       as_hitset(hitset),
+                                       recommendations).name
+
+    def test_choose_by_sizes(self):
+        few = {5: 0.5}
+        many = dict((recid, 0.5) for recid in range(100))
+        assert self.choose(list(range(1, 20)), few) == 'probe'
+        assert self.choose(list(range(1, 50)), few) == 'intersect'
+        assert self.choose(list(range(1, 50)), many) == 'probe'
+        assert self.choose(list(range(1, 50)), None) == 'probe'
+        assert self.choose(list(range(1, 50)), few,
+                           method_switch_limit=50) == 'probe'
+        # Sorted hitsets are merged, while the scores decrease
+        assert self.choose(SortedHitset(range(1, 500)), many) == 'merge'
+        assert self.choose(SortedHitset(range(1, 50)), None) == 'merge'
+        assert self.choose(SortedHitset(range(1, 50)), few,
+                           recommendations_impact=2) == 'intersect'
+
+    def test_choose_by_config(self):
+        assert self.choose(range(1, 50), {5: 0.5},
+                           ranking_strategy='probe') == 'probe'
+        # Falls back when the named strategy can not rank the hitset
+        assert self.choose([1, 2, 3], {5: 0.5},
+                           ranking_strategy='intersect') == 'probe'
+        self.assertRaises(ValueError, self.choose, range(1, 5), None,
+                          ranking_strategy='unknown')
+        if utils.numpy is not None:
+            assert self.choose(range(1, 50), {5: 0.5},
+                               scoring_engine='numpy') == 'numpy'
+
+    def test_register_strategy(self):
+        class Fixed(ranking.RankingStrategy):
+            name = 'fixed'
+
+            def cost(self, config, hitset, recommendations):
+                return -1
+
+            def rank(self, config, hitset, recommendations, limit,
+                     scores_by_size, timer):
+                return [1], [1.0]
+
+        ranking.register_strategy(Fixed())
+        try:
+            assert ranking.rank_hitset(CONFIG, as_hitset([1, 2]), None,
+                                       10) == ([1], [1.0])
+        finally:
+            ranking.unregister_strategy('fixed')
+        self.assertRaises(ValueError, ranking.get_strategy, 'fixed')
+
+    def test_strategies_rank_the_same(self):
+        rnd = random.Random(3)
+        for size in (1, 30, 500):
+            records = sorted(rnd.sample(range(1, 5000), size))
+            recommendations = dict((recid, rnd.choice([0.1, 0.5, 1.0]))
+                                   for recid in rnd.sample(records, size // 3))
+            # Duplicated records in the unsorted hitset
+            for hitset in (array('l', records), records + records[:5]):
+                hitset = as_hitset(hitset)
+                expected = ranking.ProbeStrategy().rank(
+                    CONFIG, hitset, recommendations, 20, None,
+                    NullMetrics().timer)
+                for name in ('intersect', 'merge', 'numpy'):
+                    config = dict(CONFIG, ranking_strategy=name,
+                                  method_switch_limit=0,
+                                  scoring_engine='numpy')
+                    assert ranking.rank_hitset(config, hitset,
+                                               recommendations, 20) == \
+                        expected
+
+    def test_merge_equals_probe(self):
+        rnd = random.Random(5)
+        probe = ranking.ProbeStrategy()
+        for size in (1, 2, 9, 40, 300):
+            records = sorted(rnd.sample(range(1, 5000), size))
+            hitset = SortedHitset(array('l', records))
+            recommendations = dict(
+                (recid, rnd.choice([0.0, 0.1, 0.5, 1.0]))
+                for recid in rnd.sample(records, (size + 1) // 2) + [0])
+            packed = PackedRecommendations(
+                pack_recommendations(recommendations))
+            for config in ({}, {'recommendations_impact': 1},
+                           {'recommendations_impact': 0.9},
+                           {'score_lower_limit': 1}):
+                config = dict(CONFIG, **config)
+                for recos in (recommendations, packed, None):
+                    for limit in (0, 1, 10, size, size + 5):
+                        records, scores = utils.top_records_sorted(
+                            config, hitset, recos, limit)
+                        expected = probe.rank(config, hitset, recos, limit,
+                                              None, NullMetrics().timer)
+                        assert scores == expected[1]
+                        if ORDERED_DICTS:
+                            assert records == expected[0]
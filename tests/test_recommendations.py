@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+import json
+import unittest
+
+from obelix_client import utils
+from obelix_client.api import Obelix
+from obelix_client.queue import RedisQueue
+from obelix_client.recommendations import PackedRecommendations, \
+    PackedRecommendationsEncoder, pack_recommendations
+from obelix_client.storage import RedisMock, RedisStorage
+
+
+class TestPackedRecommendations(unittest.TestCase):
+
+    def test_lookups(self):
+        recommendations = {20: 1.0, 5: 0.5, 1000000007: 0.25}
+        packed = PackedRecommendations(pack_recommendations(recommendations))
+
+        assert len(packed) == 3
+        assert 5 in packed
+        assert 6 not in packed
+        assert "5" not in packed
+        assert packed.get(20) == 1.0
+        assert packed.get(21, 0) == 0
+        assert packed[1000000007] == 0.25
+        self.assertRaises(KeyError, packed.__getitem__, 4)
+        assert packed.keys() == [5, 20, 1000000007]
+        assert packed.to_dict() == recommendations
+
+    def test_empty(self):
+        packed = PackedRecommendations(pack_recommendations({}))
+        assert len(packed) == 0
+        assert not packed
+        assert packed.get(1) is None
+
+    def test_not_packed(self):
+        self.assertRaises(ValueError, PackedRecommendations, b'{"1": 0.5}')
+
+    def test_calc_scores_drop_in(self):
+        config = {'recommendations_impact': 0.5}
+        records_by_order = {1: 0.9, 5: 0.8, 20: 0.7, 30: 0.6}
+        recommendations = {5: 0.5, 20: 1.0, 40: 0.25}
+        packed = PackedRecommendations(pack_recommendations(recommendations))
+
+        assert utils.calc_scores(config, records_by_order, packed) == \
+            utils.calc_scores(config, records_by_order, recommendations)
+
+    def test_rank_records_with_packed_storage(self):
+        recommendations = RedisStorage(RedisMock(), 'recommendations::',
+                                       encoder=PackedRecommendationsEncoder())
+        recommendations.set(1, {5: 0.5, 20: 1.0})
+        queues = RedisQueue(RedisMock(), encoder=json)
+        obelix = Obelix(RedisStorage(RedisMock(), encoder=json),
+                        recommendations, queues)
+
+        records, scores = obelix.rank_records(range(1, 30), 1, 10, 0)
+        assert records[:3] == [20, 29, 28]
+
+        user_info = {'uid': 1, 'remote_ip': "127.0.0.1", "uri": "testuri"}
+        obelix.log('search_result', user_info, [records], [records],
+                   [scores], ["Thesis"], 2, 0, 10, "recommendations",
+                   "obelix")
+        logged = queues.rpop("statistics-search-result")
+        assert logged['recommendations'] == {'5': 0.5, '20': 1.0}
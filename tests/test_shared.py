@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from obelix_client import shared
+from obelix_client.recommendations import PackedRecommendationsEncoder
+from obelix_client.shared import SharedMemoryStorage
+from obelix_client.storage import StorageProxy
+
+
+def store_in_child(path):
+    storage = SharedMemoryStorage(path, slots=16, slot_size=1024, ways=4)
+    proxy = StorageProxy(storage, 'reco::',
+                         encoder=PackedRecommendationsEncoder())
+    proxy.set(1, {5: 0.5, 20: 1.0})
+    storage.close()
+
+
+class TestSharedMemoryStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_set_and_get(self):
+        storage = SharedMemoryStorage(self.path, slots=16, slot_size=256)
+        assert storage.set("key", b"value")
+        assert storage.set(2, b"other")
+        assert storage.get("key") == b"value"
+        assert storage.get("2") == b"other"
+        assert storage.get("nothing", b"default") == b"default"
+
+        assert storage.set("key", b"new value")
+        assert storage.get("key") == b"new value"
+        assert storage.delete("key")
+        assert storage.get("key") is None
+        self.assertRaises(TypeError, storage.set, "key", 5)
+
+    def test_too_large_values_are_not_cached(self):
+        storage = SharedMemoryStorage(self.path, slots=16, slot_size=128)
+        assert storage.set("key", b"small")
+        assert not storage.set("key", b"x" * 200)
+        assert storage.get("key") is None
+
+    def test_lru_eviction_within_set(self):
+        storage = SharedMemoryStorage(self.path, slots=2, slot_size=128,
+                                      ways=2)
+        storage.set("a", b"1")
+        storage.set("b", b"2")
+        storage.get("a")
+        storage.set("c", b"3")
+        assert storage.get("b") is None
+        assert storage.get("a") == b"1"
+        assert storage.get("c") == b"3"
+
+    def test_expiry(self):
+        storage = SharedMemoryStorage(self.path, slots=16, slot_size=128)
+        storage.set("key", b"value", ex=-1)
+        assert storage.get("key") is None
+        storage.set("key", b"value", ex=60)
+        assert storage.get("key") == b"value"
+
+    def test_layout_mismatch(self):
+        SharedMemoryStorage(self.path, slots=16, slot_size=128).close()
+        self.assertRaises(ValueError, SharedMemoryStorage, self.path,
+                          slots=32, slot_size=128)
+
+    def test_needs_fcntl(self):
+        fcntl = shared.fcntl
+        shared.fcntl = None
+        try:
+            # Without locks, processes would corrupt the shared file
+            self.assertRaises(ImportError, SharedMemoryStorage, self.path)
+        finally:
+            shared.fcntl = fcntl
+        assert not os.path.exists(self.path)
+
+    def test_shared_between_processes(self):
+        storage = SharedMemoryStorage(self.path, slots=16, slot_size=1024,
+                                      ways=4)
+        process = multiprocessing.Process(target=store_in_child,
+                                          args=(self.path,))
+        process.start()
+        process.join(10)
+        assert process.exitcode == 0
+
+        proxy = StorageProxy(storage, 'reco::',
+                             encoder=PackedRecommendationsEncoder())
+        recommendations = proxy.get(1)
+        assert recommendations.get(20) == 1.0
+        assert 5 in recommendations
+
+    def test_with_storage_proxy(self):
+        storage = StorageProxy(SharedMemoryStorage(self.path),
+                               prefix='pre::', encoder=json)
+        storage.set("settings", {'recommendations_impact': 0.5})
+        assert storage.get("settings") == {'recommendations_impact': 0.5}
+        assert storage.get("nothing", {}) == {}
@@ -20,7 +20,8 @@
 import json
 import unittest
 
-from obelix_client.storage import RedisMock, RedisStorage, StorageProxy
+from obelix_client.storage import CachedStorage, RedisMock, RedisStorage, \
+    StorageProxy
 
 
 class TestStorageDict(unittest.TestCase):
@@ -48,3 +49,111 @@ class TestStorageDict(unittest.TestCase):
         assert storage.get("theKey2") == "theValue2"
         assert storage.get("theKey") == "theValue"
         assert storage.get("noKey") == None
+
+    def test_get_many_and_set_many(self):
+        for storage in (StorageProxy({}, prefix='pre::', encoder=json),
+                        RedisStorage(RedisMock(), prefix='pre::',
+                                     encoder=json)):
+            storage.set_many({"theKey": "theValue", "theKey2": [1, 2]})
+            storage.set("empty", [])
+            assert storage.get_many(["theKey2", "noKey", "theKey"]) == \
+                [[1, 2], None, "theValue"]
+            assert storage.get_many(["noKey", "empty"], default={}) == \
+                [storage.get("noKey", {}), storage.get("empty", {})]
+            assert storage.get_many([]) == []
+
+    def test_redis_get_many_single_round_trip(self):
+        calls = []
+
+        class CountingRedisMock(RedisMock):
+            def mget(self, keys):
+                calls.append(keys)
+                return super(CountingRedisMock, self).mget(keys)
+
+        storage = RedisStorage(CountingRedisMock(), prefix='pre::',
+                               encoder=json)
+        storage.set_many({1: {"5": 0.5}, 2: {"20": 1.0}})
+        assert storage.get_many([1, 2, 3]) == [{"5": 0.5}, {"20": 1.0}, None]
+        assert calls == [['pre::1', 'pre::2', 'pre::3']]
+
+
+class CountingStorage(StorageProxy):
+
+    def __init__(self, *args, **kwargs):
+        super(CountingStorage, self).__init__(*args, **kwargs)
+        self.gets = 0
+
+    def get(self, key, default=None):
+        self.gets += 1
+        return super(CountingStorage, self).get(key, default)
+
+    def get_many(self, keys, default=None):
+        self.gets += 1
+        return super(CountingStorage, self).get_many(keys, default)
+
+
+class TestCachedStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.now = [0]
+        self.storage = CountingStorage(RedisMock(), encoder=json)
+        self.cached = CachedStorage(self.storage, maxsize=2, ttl=10,
+                                    negative_ttl=1,
+                                    timer=lambda: self.now[0])
+
+    def test_get_is_cached(self):
+        self.storage.set("a", {"1": 1.0})
+        assert self.cached.get("a") == {"1": 1.0}
+        assert self.cached.get("a") == {"1": 1.0}
+        assert self.storage.gets == 1
+        assert (self.cached.hits, self.cached.misses) == (1, 1)
+
+    def test_ttl_expires(self):
+        self.storage.set("a", 1)
+        self.cached.get("a")
+        self.storage.set("a", 2)
+        assert self.cached.get("a") == 1
+        self.now[0] = 10
+        assert self.cached.get("a") == 2
+
+    def test_negative_caching(self):
+        assert self.cached.get("nokey", "default") == "default"
+        self.storage.set("nokey", 1)
+        assert self.cached.get("nokey") is None
+        assert self.cached.negative_hits == 1
+        assert self.storage.gets == 1
+        self.now[0] = 1
+        assert self.cached.get("nokey") == 1
+
+    def test_lru_eviction(self):
+        for key in "abc":
+            self.cached.set(key, key)
+        assert self.cached.get("a") == "a"
+        assert self.cached.get("c") == "c"
+        assert self.storage.gets == 1
+
+    def test_set_writes_through(self):
+        self.cached.set("a", [1, 2], ttl=5)
+        assert self.storage.get("a") == [1, 2]
+        assert self.storage.storage.expires
+        self.now[0] = 5
+        assert self.cached.get("a") == [1, 2]
+        assert self.storage.gets == 2
+
+    def test_get_many(self):
+        self.storage.set_many({"a": 1, "b": 2})
+        self.cached.get("a")
+        assert self.cached.get_many(["a", "b", "c"], 0) == [1, 2, 0]
+        assert self.storage.gets == 2
+        self.cached.set_many({"c": 3})
+        assert self.cached.get_many(["b", "c"]) == [2, 3]
+        assert self.storage.gets == 2
+
+    def test_per_key_ttl(self):
+        cached = CachedStorage(self.storage, ttl=10, ttls={"settings": 1},
+                               timer=lambda: self.now[0])
+        cached.set("settings", {"x": 1})
+        cached.set("other", 1)
+        self.now[0] = 1
+        assert "settings" not in cached.cache
+        assert "other" in cached.cache
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Obelix.
+# Copyright (C) 2015 CERN.
+#
+# Obelix is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Obelix is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Obelix; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+import json
+import random
+import sys
+import threading
+import time
+import unittest
+from array import array
+
+from obelix_client import utils
+from obelix_client.queue import RedisQueue
+from obelix_client.recommendations import PackedRecommendations, \
+    pack_recommendations
+from obelix_client.storage import RedisMock
+
+#: Ties are broken by insertion order only where dictionaries keep it
+ORDERED_DICTS = sys.version_info >= (3, 6)
+
+
+class TestTopRecords(unittest.TestCase):
+
+    def test_top_records_equals_full_sort(self):
+        rnd = random.Random(42)
+        # Few distinct scores to get plenty of ties
+        rec_scores = {}
+        for recid in rnd.sample(range(1, 5000), 1000):
+            rec_scores[recid] = rnd.choice([0.1, 0.25, 0.5, 0.75, 1.0])
+
+        records, scores = utils.sort_records_by_score(rec_scores)
+        for limit in (0, 1, 10, 37, 999, 1000, 1500):
+            assert utils.top_records_by_score(rec_scores, limit) == \
+                (records[:limit], scores[:limit])
+
+    def test_top_records_empty(self):
+        assert utils.top_records_by_score({}, 10) == ([], [])
+
+
+class TestOrderScores(unittest.TestCase):
+
+    def test_shared_order_scores(self):
+        conf = {'score_lower_limit': 0.2, 'score_min_limit': 10,
+                'score_min_multiply': 4, 'score_one_result': 1}
+        for size in (1, 2, 9, 10, 55):
+            hitset = list(range(size, 0, -1))
+            scores = utils.order_scores(conf, size)
+            assert len(scores) == size
+            assert utils.rank_records_by_order(conf, hitset) == \
+                utils.rank_records_by_order(conf, hitset, scores)
+        assert utils.order_scores(conf, 2) == [0.8, 0.7]
+        assert utils.rank_records_by_order(conf, []) == {}
+
+    def test_shared_order_scores_memo(self):
+        conf = {'score_lower_limit': 0.2, 'score_min_limit': 10,
+                'score_min_multiply': 4, 'score_one_result': 1}
+        memo = utils.order_scores_memo
+        memo.clear()
+        hits, misses = memo.hits, memo.misses
+
+        scores = utils.shared_order_scores(conf, 50)
+        assert scores == tuple(utils.order_scores(conf, 50))
+        assert utils.rank_records_by_order(conf, list(range(50))) == \
+            dict(zip(range(50), scores))
+        assert utils.shared_order_scores(dict(conf, score_lower_limit=0.5),
+                                         50) != scores
+        assert (memo.hits - hits, memo.misses - misses) == (1, 2)
+
+        size = utils.ORDER_SCORES_MEMO_MAX_SIZE + 1
+        assert utils.shared_order_scores(conf, size) is None
+        assert len(memo) == 2
+        assert memo.size == 100
+
+
+class TestReversedHitset(unittest.TestCase):
+
+    def test_reversed_view(self):
+        hitset = utils.reversed_hitset(range(1, 6))
+        assert list(hitset) == [5, 4, 3, 2, 1]
+        assert len(hitset) == 5
+        assert (hitset[0], hitset[-1], hitset[1:4]) == (5, 1, [4, 3, 2])
+        self.assertRaises(IndexError, hitset.__getitem__, 5)
+        assert utils.hitset_fingerprint(hitset) == \
+            utils.hitset_fingerprint([5, 4, 3, 2, 1])
+
+    def test_iterator_read_once(self):
+        hitset = utils.reversed_hitset(iter([1, 2, 3]))
+        assert list(hitset) == [3, 2, 1]
+        assert list(hitset) == [3, 2, 1]
+
+
+class TestSortedScores(unittest.TestCase):
+
+    def test_sorted_scores_equal_calc_scores(self):
+        rnd = random.Random(7)
+        conf = {'score_lower_limit': 0.2, 'score_min_limit': 10,
+                'score_min_multiply': 4, 'score_one_result': 1,
+                'recommendations_impact': 0.3}
+        for size in (1, 5, 300):
+            records = sorted(rnd.sample(range(1, 5000), size))
+            recommendations = dict(
+                (recid, rnd.random())
+                for recid in rnd.sample(records, size // 2) + [0, 6000])
+            hitset = utils.SortedHitset(array('l', records))
+            expected = utils.calc_scores(
+                conf, utils.rank_records_by_order(conf, records[::-1]),
+                recommendations)
+
+            final_scores = utils.calc_scores_sorted(conf, hitset,
+                                                    recommendations)
+            assert final_scores == expected
+            if ORDERED_DICTS:
+                assert list(final_scores) == list(expected)
+
+
+class TestHitIndex(unittest.TestCase):
+
+    def test_hit_index_equals_scan(self):
+        rnd = random.Random(3)
+        record_ids = [[rnd.randint(1, 40) for _ in range(size)]
+                      for size in (30, 0, 25, 10)]
+        index = utils.build_hit_index(json.loads(json.dumps(record_ids)))
+
+        for recid in range(0, 45):
+            assert index.get(str(recid), []) == \
+                utils.find_hits(record_ids, recid)
+
+    def test_shown_hit_index_equals_scan(self):
+        rnd = random.Random(5)
+        record_ids = [[rnd.randint(1, 60) for _ in range(size)]
+                      for size in (30, 5, 25, 40)]
+        index = utils.build_hit_index(record_ids, 10, 10)
+
+        for recid in range(0, 65):
+            # The hits of the collections showing the record, numbered
+            # as in all the results
+            shown = [collection for collection, collection_result
+                     in enumerate(record_ids)
+                     if recid in collection_result[10:20]]
+            assert index.get(str(recid), []) == \
+                [hit for hit in utils.find_hits(record_ids, recid)
+                 if hit[0] in shown]
+
+    def test_find_hits(self):
+        record_ids = [[1, 88], [1, 2]]
+        assert utils.find_hits(record_ids, 1) == [[0, 0, 0], [1, 0, 2]]
+        assert utils.find_hits(record_ids, 2) == [[1, 1, 3]]
+        assert utils.find_hits(record_ids, 3) == []
+
+
+@unittest.skipIf(utils.numpy is None, "NumPy is not installed")
+class TestArrayEngine(unittest.TestCase):
+
+    config = {'recommendations_impact': 0.5,
+              'score_lower_limit': 0.2,
+              'score_min_limit': 10,
+              'score_min_multiply': 4,
+              'score_one_result': 1}
+
+    def rank_python(self, hitset, recommendations, limit):
+        records_by_order = utils.rank_records_by_order(self.config, hitset)
+        if recommendations is not None:
+            records_by_order = utils.calc_scores(self.config,
+                                                 records_by_order,
+                                                 recommendations)
+        return utils.top_records_by_score(records_by_order, limit)
+
+    def test_array_engine_equals_python_engine(self):
+        rnd = random.Random(7)
+        for size in (0, 1, 2, 9, 10, 11, 29, 500, 3000):
+            hitset = rnd.sample(range(1, 10000), size)
+            recommendations = dict(
+                (recid, rnd.choice([0.5, 1.0, rnd.random()]))
+                for recid in rnd.sample(range(1, 10000), 300))
+            for reco in (None, {}, recommendations):
+                for limit in (1, 10, 31, size + 5):
+                    assert utils.rank_records_array(
+                        self.config, hitset, reco, limit) == \
+                        self.rank_python(hitset, reco, limit)
+
+    def test_array_engine_packed_recommendations(self):
+        hitset = list(range(200, 0, -1))
+        recommendations = {5: 0.5, 20: 1.0, 300: 0.75}
+        packed = PackedRecommendations(pack_recommendations(recommendations))
+        assert utils.rank_records_array(self.config, hitset, packed, 10) == \
+            self.rank_python(hitset, recommendations, 10)
+
+    def test_array_engine_duplicated_recids(self):
+        hitset = [5, 3, 5, 8, 3, 1, 9, 9, 2, 4, 7, 6]
+        recommendations = {3: 1.0, 9: 0.2}
+        assert utils.rank_records_array(
+            self.config, hitset, recommendations, 20) == \
+            self.rank_python(hitset, recommendations, 20)
+
+
+class TestSendToObelix(unittest.TestCase):
+
+    def test_batched_push(self):
+        queue = RedisQueue(RedisMock(), encoder=json)
+        publisher = utils.SendToObelix(queue, batch_size=3)
+
+        publisher.save_to_neo_feeder({'item': 1})
+        publisher.statistics_page_view({'recid': 1})
+        assert queue.rpop("logentries") is None
+
+        publisher.save_to_neo_feeder({'item': 2})
+        assert queue.rpop("logentries") == {'item': 1}
+        assert queue.rpop("logentries") == {'item': 2}
+        assert queue.rpop("statistics-page-view") == {'recid': 1}
+
+    def test_flush_interval(self):
+        now = [0]
+        queue = RedisQueue(RedisMock(), encoder=json)
+        publisher = utils.SendToObelix(queue, batch_size=100,
+                                       flush_interval=5,
+                                       timer=lambda: now[0])
+
+        publisher.save_to_neo_feeder({'item': 1})
+        assert queue.rpop("logentries") is None
+        now[0] = 6
+        publisher.save_to_neo_feeder({'item': 2})
+        assert queue.rpop("logentries") == {'item': 1}
+        assert queue.rpop("logentries") == {'item': 2}
+
+    def test_flush_interval_idle(self):
+        queue = RedisQueue(RedisMock(), encoder=json)
+        publisher = utils.SendToObelix(queue, batch_size=100,
+                                       flush_interval=0.01)
+
+        publisher.save_to_neo_feeder({'item': 1})
+        # No other event comes, the timer flushes the buffer
+        deadline = time.time() + 5
+        event = queue.rpop("logentries")
+        while event is None and time.time() < deadline:
+            time.sleep(0.01)
+            event = queue.rpop("logentries")
+        assert event == {'item': 1}
+        assert publisher.flush_timer is None
+
+    def test_failed_push_buffered_again(self):
+        storage = FailingRedisMock()
+        queue = RedisQueue(storage, encoder=json)
+        publisher = utils.SendToObelix(queue, batch_size=100)
+
+        publisher.save_to_neo_feeder({'item': 1})
+        storage.failing = True
+        self.assertRaises(IOError, publisher.flush)
+        assert (publisher.failed, publisher.buffered) == (1, 1)
+
+        publisher.save_to_neo_feeder({'item': 2})
+        storage.failing = False
+        publisher.flush()
+        assert queue.rpop("logentries") == {'item': 1}
+        assert queue.rpop("logentries") == {'item': 2}
+
+    def test_failed_timer_flush_retried(self):
+        storage = FailingRedisMock()
+        storage.failing = True
+        queue = RedisQueue(storage, encoder=json)
+        publisher = utils.SendToObelix(queue, batch_size=100,
+                                       flush_interval=0.01)
+
+        publisher.save_to_neo_feeder({'item': 1})
+        deadline = time.time() + 5
+        while not publisher.failed and time.time() < deadline:
+            time.sleep(0.01)
+        assert publisher.failed
+        # The events stay buffered, the timer tries again
+        storage.failing = False
+        event = queue.rpop("logentries")
+        while event is None and time.time() < deadline:
+            time.sleep(0.01)
+            event = queue.rpop("logentries")
+        assert event == {'item': 1}
+
+    def test_explicit_flush(self):
+        queue = RedisQueue(RedisMock(), encoder=json)
+        publisher = utils.SendToObelix(queue, batch_size=100)
+
+        publisher.statistics_search_result({'uid': 1})
+        publisher.flush()
+        assert queue.rpop("statistics-search-result") == {'uid': 1}
+        publisher.flush()
+        assert queue.rpop("statistics-search-result") is None
+
+
+class BlockingRedisMock(RedisMock):
+
+    """RedisMock whose pushes wait until released."""
+
+    def __init__(self):
+        super(BlockingRedisMock, self).__init__()
+        self.release = threading.Event()
+        self.entered = threading.Event()
+
+    def lpush(self, queue, *values):
+        self.entered.set()
+        self.release.wait(5)
+        super(BlockingRedisMock, self).lpush(queue, *values)
+
+
+class FailingRedisMock(RedisMock):
+
+    """RedisMock whose pushes fail while ``failing`` is set."""
+
+    failing = False
+
+    def lpush(self, queue, *values):
+        if self.failing:
+            raise IOError("Connection refused")
+        super(FailingRedisMock, self).lpush(queue, *values)
+
+
+class TestBackgroundSendToObelix(unittest.TestCase):
+
+    def test_background_push(self):
+        queue = RedisQueue(RedisMock(), encoder=json)
+        publisher = utils.BackgroundSendToObelix(queue)
+
+        for i in range(50):
+            publisher.save_to_neo_feeder({'item': i})
+        assert publisher.flush(timeout=5)
+        for i in range(50):
+            assert queue.rpop("logentries") == {'item': i}
+        assert publisher.pushed == 50
+        publisher.close(timeout=5)
+        assert not publisher.worker.is_alive()
+
+    def fill_stalled(self, overflow, **kwargs):
+        storage = BlockingRedisMock()
+        publisher = utils.BackgroundSendToObelix(
+            RedisQueue(storage), maxsize=2, overflow=overflow, **kwargs)
+        # The first event keeps the worker busy, the next ones are buffered
+        publisher.save_to_neo_feeder(0)
+        storage.entered.wait(5)
+        for i in range(1, 5):
+            publisher.save_to_neo_feeder(i)
+        storage.release.set()
+        publisher.close(timeout=5)
+        return publisher, storage.lrange("logentries", 0, -1)
+
+    def test_drop_oldest(self):
+        publisher, pushed = self.fill_stalled('drop-oldest')
+        assert publisher.dropped == 2
+        assert pushed == [4, 3, 0]
+
+    def test_drop_newest(self):
+        publisher, pushed = self.fill_stalled('drop-newest')
+        assert publisher.dropped == 2
+        assert pushed == [2, 1, 0]
+
+    def test_block_timeout(self):
+        publisher, pushed = self.fill_stalled('block', block_timeout=0.01)
+        assert publisher.dropped == 2
+        assert pushed == [2, 1, 0]
+
+    def test_unknown_overflow_policy(self):
+        self.assertRaises(ValueError, utils.BackgroundSendToObelix,
+                          RedisQueue(RedisMock()), overflow='explode')